@@ -1,12 +1,29 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import os
 import time
 import re
+import threading
+import logging
+from collections import OrderedDict
+from functools import partial
+from repair_core import (
+    HAS_AI, REPAIR_COLS, MAINTAIN_COLS, INSPECT_COLS, ID_COL, REPAIR_DERIVED_COLS,
+    SNAPSHOT_DIR, SnapshotStore, RecordRowIndex, IncrementalSearchIndex, sync_search_index, SEARCH_FIELD_WEIGHTS,
+    clean_text, new_record_id, finalize_repair_frame, repair_data_version, build_repair_hierarchy, order_topic_groups,
+    DASHBOARD_NODE_LIMIT, count_repair_topics, dashboard_summary,
+    normalize_repair_records, normalize_maintain_rows, normalize_inspect_rows,
+    DEFAULT_COLOR_RULES, COLOR_RULES_FILE, PartColorRules, parse_color_rule_rows, load_color_rules_file,
+    data_version, maintain_line_items, inspect_line_items,
+    super_smart_search, normalize_query, metrics, facet_values, SEARCH_CANDIDATES,
+)
+
+logger = logging.getLogger("repair_app")
 
 # ---------------------------------------------------------
 # 1. 核心設定 & CSS (按鈕一致化 + 垂直排列 + 顏色定義)
@@ -207,79 +224,6 @@ st.markdown("""
 # ---------------------------------------------------------
 # 2. 資料處理 (維修、保養、點檢)
 # ---------------------------------------------------------
-HAS_AI = False
-HAS_FUZZY = False
-
-try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
-    HAS_AI = True
-except ImportError:
-    HAS_AI = False
-
-try:
-    from rapidfuzz import process, fuzz
-    HAS_FUZZY = True
-except ImportError:
-    HAS_FUZZY = False
-
-REPAIR_COLS = ['設備型號', '大標', '主題(事件簡述)', '原因(異常查找、分析)', '處置、應對', '驗證是否排除(驗證作法)', '備註(建議事項及補充事項)']
-MAINTAIN_COLS = ['保養類型', '型號', '更換料件']
-INSPECT_COLS = ['項目各部', '各部細項'] # 點檢表欄位
-
-# === 顏色規則 (保養用) ===
-COLOR_RULES = {
-    "420單向軸承": {
-        "500K": {
-            "red": ["B2476", "B1556", "T2400", "T2670", "D2487", "D2488", "D2510", "D3611", "D2354", "D2355", "D2356", "D2348", "D2349", "D2602", "D2362"],
-            "green": []
-        },
-        "1M": {
-            "red": ["B2476", "B1556", "T2400", "T2670", "D2487", "D2488", "D2510", "D3611", "D2354", "D2355", "D2356", "D2348", "D2349", "D2602"],
-            "green": ["B1008", "B695", "B992", "B1041", "B1054", "B993", "D3466", "D2642", "D2643", "D2443", "D2674", "D2347", "E2646", "E2647", "D2481", "D2664", "D3496", "D1614", "D3053", "D2449", "D2568", "D2340", "D2567", "D120", "D121"]
-        }
-    },
-    "HGT-421": {
-        "500K": {
-            "red": ["B1556", "B2476", "T2670", "D3089", "D3090", "D3523", "D3524", "D2602", "D3494", "D3462", "D3463", "D2487", "D2488", "D3254"],
-            "green": []
-        },
-        "1M": {
-            "red": ["B1556", "B2476", "T2670", "D3089", "D3090", "D3523", "D3524", "D2602", "D3494", "D3462", "D3463", "D2487", "D2488", "D3254"],
-            "green": ["D3530", "D3529", "B695", "B992", "D3213", "D3176", "D3181", "D2514", "D3496", "D2347", "D2510", "D3166", "D3167", "D2798", "D3215", "D2340", "E2646", "E2647", "D2481", "D2664"]
-        }
-    }
-}
-
-def get_part_color_class(part_name, model, interval):
-    clean_interval = interval.replace("保養", "").upper().strip()
-    if model in COLOR_RULES and clean_interval in COLOR_RULES[model]:
-        rules = COLOR_RULES[model][clean_interval]
-        for key in rules["red"]:
-            if key in part_name: return "text-red", "🔴"
-        for key in rules["green"]:
-            if key in part_name: return "text-green", "🟢"
-    return "text-normal", "🔩"
-
-def clean_text(text):
-    if not isinstance(text, str): return str(text)
-    text = text.replace("**", "")
-    text = text.replace("\n", " ").strip()
-    return text
-
-def expand_query(query):
-    SYNONYMS = {
-        "聲音": "異音 噪音 吵雜 聲響", "怪聲": "異音 磨損",
-        "不動": "卡死 異常 停止 無法運作失效", "壞掉": "異常 故障 損壞",
-        "溫度": "過熱 發燙 高溫", "漏水": "洩漏 滲水",
-        "轉速": "速度 變慢", "sensor": "感應器 光電",
-        "馬達": "motor", "皮帶": "斷裂 磨損",
-        "飛板": "fly board 驅動板", 
-    }
-    q = query
-    for k, v in SYNONYMS.items():
-        if k in query.lower(): q += " " + v
-    return q
 
 def get_google_sheet_connection():
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -288,165 +232,576 @@ def get_google_sheet_connection():
     client = gspread.authorize(creds)
     return client
 
-@st.cache_data(ttl=5)
-def load_repair_data():
+# === 連線池 (整個行程共用已授權的 client 與三張工作表) ===
+CLIENT_MAX_AGE = 50 * 60  # 秒；Google access token 效期一小時，提早重新授權
+
+class SheetPool:
+    """保存授權後的 gspread client 與 repair/maintain/inspect 工作表控制代碼"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._authorized_at = 0
+        self._worksheets = {}
+        self._headers = {}
+
+    def _client_expired(self):
+        return self._client is None or time.time() - self._authorized_at > CLIENT_MAX_AGE
+
+    def worksheet(self, name):
+        with self._lock:
+            if self._client_expired():
+                self._client = get_google_sheet_connection()
+                self._authorized_at = time.time()
+                self._worksheets = {}
+                self._headers = {}
+            if name in self._worksheets: return self._worksheets[name]
+            client = self._client
+        # 開啟試算表不佔著鎖，三張表可以同時開
+        sheet_url = st.secrets["sheets"][f"{name}_url"]
+        worksheet = client.open_by_url(sheet_url).get_worksheet(0)
+        with self._lock:
+            if self._client is client: self._worksheets.setdefault(name, worksheet)
+            return self._worksheets.get(name, worksheet)
+
+    def header(self, name):
+        # 表頭 (第一列) 也一併快取，單筆寫入時用來對應欄位位置
+        worksheet = self.worksheet(name)
+        with self._lock:
+            if name not in self._headers:
+                self._headers[name] = worksheet.row_values(1)
+            return self._headers[name]
+
+    def forget_header(self, name):
+        with self._lock:
+            self._headers.pop(name, None)
+
+    def invalidate(self):
+        # 發生錯誤時丟棄連線，下一次呼叫重新授權
+        with self._lock:
+            self._client = None
+            self._worksheets = {}
+            self._headers = {}
+
+@st.cache_resource
+def get_sheet_pool():
+    return SheetPool()
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore(SNAPSHOT_DIR)
+
+def ensure_record_ids(worksheet, df, queue):
+    """補上缺少或重複的紀錄ID (第一次啟用，或有人直接在試算表新增/複製列)，只回寫缺ID的那幾格
+
+    讀取到回寫之間若有人增刪列，整批位置都會錯開：回寫前在寫入鎖內 (與寫入佇列互斥) 重讀ID欄，
+    與讀到的資料不一致就放棄這次抓取，下一次抓取再補。
+    """
+    if ID_COL not in df.columns: df[ID_COL] = ""
+    missing = ((df[ID_COL] == "") | df[ID_COL].duplicated()).to_numpy()
+    if not missing.any(): return df
+    read_ids = df[ID_COL].tolist()
+    new_ids = [new_record_id() for _ in range(int(missing.sum()))]
+    with queue.sheet_lock:
+        header = worksheet.row_values(1)
+        requests = []
+        if ID_COL in header:
+            col = header.index(ID_COL) + 1
+            # 與 normalize_repair_records 一樣去除前後空白再比對
+            current = [rid.strip() for rid in worksheet.col_values(col)[1:]]
+        else:
+            col = len(header) + 1
+            if worksheet.col_count < col: worksheet.add_cols(col - worksheet.col_count)
+            current = []
+            requests.append(_id_cells_request(worksheet.id, 0, col, [ID_COL]))
+        current += [""] * (len(read_ids) - len(current))
+        if current != read_ids:
+            raise RuntimeError("紀錄ID欄在讀取後有變動，下次抓取再補ID")
+        # 連續缺ID的列合成一個請求
+        positions = np.flatnonzero(missing)
+        for run in np.split(np.arange(len(positions)), np.flatnonzero(np.diff(positions) != 1) + 1):
+            requests.append(_id_cells_request(worksheet.id, int(positions[run[0]]) + 1, col, [new_ids[i] for i in run]))
+        worksheet.spreadsheet.batch_update({"requests": requests})
+    df.loc[missing, ID_COL] = new_ids
+    queue.pool.forget_header("repair")
+    return df
+
+def _id_cells_request(sheet_id, start_row, col, values):
+    # start_row 從 0 起算 (0 是表頭)；values 由上往下寫在第 col 欄
+    return {"updateCells": {
+        "range": {"sheetId": sheet_id, "startRowIndex": start_row, "endRowIndex": start_row + len(values), "startColumnIndex": col - 1, "endColumnIndex": col},
+        "rows": [_row_data([v]) for v in values],
+        "fields": "userEnteredValue"
+    }}
+
+# 抓取函式會在背景執行緒 (快照更新、預先抓取) 執行：連線池與寫入佇列由呼叫端傳入，
+# 執行緒內不呼叫 st.cache_resource (沒有 ScriptRunContext，每次都會記一筆警告)
+def fetch_repair_data(pool, queue):
     try:
-        client = get_google_sheet_connection()
-        sheet_url = st.secrets["sheets"]["repair_url"]
-        sh = client.open_by_url(sheet_url)
-        worksheet = sh.get_worksheet(0)
-        data = worksheet.get_all_records()
-        df = pd.DataFrame(data)
-        if df.empty: return pd.DataFrame(columns=REPAIR_COLS)
-        for col in REPAIR_COLS:
-            if col not in df.columns: df[col] = "無"
-        for col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
-        df['original_id'] = df.index
-        df['search_content'] = (
-            (df['設備型號'] + " ") * 2 + 
-            (df['主題(事件簡述)'] + " ") * 5 + 
-            (df['原因(異常查找、分析)'] + " ") * 3 + 
-            df['處置、應對']
-        )
-        return df
+        worksheet = pool.worksheet("repair")
+        index_version = queue.row_index.version
+        with metrics.timer("fetch.repair") as t:
+            # 儲存格一律當字串讀：像 "012345678901"、"1234e5678901" 的紀錄ID不可被轉成數字
+            records = worksheet.get_all_records(numericise_ignore=['all'])
+            t.count = len(records)
+        with metrics.timer("normalize.repair") as t:
+            t.count = len(records)
+            df = normalize_repair_records(records)
+            if df.empty: return finalize_repair_frame(df)
+            df = ensure_record_ids(worksheet, df, queue)
+            queue.row_index.rebuild(df[ID_COL].tolist(), index_version)
+            return finalize_repair_frame(df)
     except Exception as e:
-        return pd.DataFrame(columns=REPAIR_COLS)
+        pool.invalidate()
+        return None
 
-@st.cache_data(ttl=60)
-def load_maintain_data():
+def fetch_maintain_data(pool):
     try:
-        client = get_google_sheet_connection()
-        sheet_url = st.secrets["sheets"]["maintain_url"]
-        sh = client.open_by_url(sheet_url)
-        worksheet = sh.get_worksheet(0)
-        rows = worksheet.get_all_values()
-        if not rows: return pd.DataFrame(columns=MAINTAIN_COLS)
-        header = rows[0]
-        data = rows[1:]
-        df = pd.DataFrame(data, columns=header)
-        df.replace("", float("NaN"), inplace=True)
-        df['保養類型'] = df['保養類型'].ffill()
-        df['型號'] = df['型號'].ffill()
-        df['保養類型'] = df['保養類型'].astype(str).str.upper().str.strip()
-        df = df.dropna(subset=['更換料件'])
-        df.fillna("", inplace=True)
-        return df
+        worksheet = pool.worksheet("maintain")
+        with metrics.timer("fetch.maintain") as t:
+            rows = worksheet.get_all_values()
+            t.count = len(rows)
+        with metrics.timer("normalize.maintain") as t:
+            t.count = len(rows)
+            return normalize_maintain_rows(rows)
+    except Exception as e:
+        pool.invalidate()
+        return None
+
+def fetch_inspect_data(pool):
+    try:
+        worksheet = pool.worksheet("inspect")
+        with metrics.timer("fetch.inspect") as t:
+            rows = worksheet.get_all_values()
+            t.count = len(rows)
+        with metrics.timer("normalize.inspect") as t:
+            t.count = len(rows)
+            return normalize_inspect_rows(rows)
+    except Exception as e:
+        pool.invalidate()
+        return None
+
+# === 顏色規則 (保養用)：有設定 [sheets] color_rules_url 就讀規則表，其次讀 REPAIR_APP_COLOR_RULES 檔案，都沒有用內建表 ===
+def fetch_color_rules():
+    if "color_rules_url" in st.secrets.get("sheets", {}):
+        try:
+            worksheet = get_sheet_pool().worksheet("color_rules")
+            with metrics.timer("fetch.color_rules") as t:
+                rows = worksheet.get_all_values()
+                t.count = len(rows)
+        except Exception as e:
+            get_sheet_pool().invalidate()
+            logger.warning("讀取顏色規則表失敗，改用備用規則：%s", e)
+        else:
+            # 表格內容有誤與連線無關，不丟棄連線池
+            try:
+                rules = parse_color_rule_rows(rows)
+                if rules: return rules
+                logger.warning("顏色規則表沒有任何規則，改用備用規則")
+            except ValueError as e:
+                logger.warning("顏色規則表格式錯誤，改用備用規則：%s", e)
+    try:
+        if COLOR_RULES_FILE: return load_color_rules_file(COLOR_RULES_FILE)
     except Exception as e:
-        return pd.DataFrame(columns=MAINTAIN_COLS)
+        logger.warning("讀取顏色規則檔 %s 失敗，改用內建規則：%s", COLOR_RULES_FILE, e)
+    return DEFAULT_COLOR_RULES
+
+# 編好的比對器整個行程共用，規則表改了最多十分鐘後生效
+@st.cache_resource(ttl=600)
+def get_part_color_rules():
+    return PartColorRules(fetch_color_rules())
+
+# === 保養、點檢清單：拆行、上色、組 HTML 都在這裡做一次，頁面只送出一整塊 ===
+LIST_BOX_STYLE = "background-color: white; border-radius: 10px; box-shadow: 0 4px 6px rgba(0,0,0,0.05); padding: 5px;"
+
+def list_block_html(lines):
+    # lines: [(文字, CSS class, 圖示), ...]
+    rows = "".join(f'<div class="list-item"><span class="list-icon">{icon}</span><span class="list-text {color_class}">{text}</span></div>' for text, color_class, icon in lines)
+    return f'<div style="{LIST_BOX_STYLE}">{rows}</div>'
+
+@st.cache_resource(max_entries=2)
+def get_maintain_lists(data_version, rules_version, _df, _rules):
+    """{(保養類型, 型號): (料件行數, HTML)}"""
+    return {key: (len(lines), list_block_html(lines)) for key, lines in maintain_line_items(_df, _rules).items()}
+
+@st.cache_resource(max_entries=2)
+def get_inspect_lists(data_version, _df):
+    """{項目各部: (細項行數, HTML)}"""
+    return {key: (len(lines), list_block_html([(line, "text-normal", "🔍") for line in lines])) for key, lines in inspect_line_items(_df).items()}
+
+@st.cache_resource
+def get_sheet_sources():
+    """{表名: 抓取函式}：在主執行緒取好共用資源綁進去，交給快照的背景更新直接呼叫"""
+    pool, queue = get_sheet_pool(), get_write_queue()
+    return {"repair": partial(fetch_repair_data, pool, queue), "maintain": partial(fetch_maintain_data, pool), "inspect": partial(fetch_inspect_data, pool)}
+
+def prefetch_sheets():
+    # 冷啟動 (本地沒有快照) 時三張表同時抓，之後各自的 load_* 直接拿結果
+    get_snapshot_store().prefetch(get_sheet_sources())
+
+@st.cache_data(ttl=5)
+def load_repair_data():
+    return get_snapshot_store().load("repair", get_sheet_sources()["repair"], REPAIR_COLS)
+
+@st.cache_data(ttl=60)
+def load_maintain_data():
+    return get_snapshot_store().load("maintain", get_sheet_sources()["maintain"], MAINTAIN_COLS)
 
 # === 新增：讀取點檢表 ===
 @st.cache_data(ttl=60)
 def load_inspect_data():
+    return get_snapshot_store().load("inspect", get_sheet_sources()["inspect"], INSPECT_COLS)
+
+# === 側邊欄選項清單 (只讀快照旁的小清單檔，不載入整張表) ===
+@st.cache_data(ttl=5)
+def load_sidebar_facets():
+    store, sources = get_snapshot_store(), get_sheet_sources()
+    return {
+        "repair": store.load_facets("repair", sources["repair"], REPAIR_COLS),
+        "maintain": store.load_facets("maintain", sources["maintain"], MAINTAIN_COLS),
+        "inspect": store.load_facets("inspect", sources["inspect"], INSPECT_COLS),
+    }
+
+# 各頁面需要的資料；延遲載入模式下其餘的表與搜尋索引都不碰
+VIEW_DATA = {
+    "ai_search": {"repair", "search"},
+    "dashboard": {"repair"},
+    "repair_log": {"repair"},
+    "add_edit_repair": {"repair"},
+    "maintenance_log": {"maintain"},
+    "inspect_log": {"inspect"},
+}
+
+def lazy_loading():
+    # secrets.toml 設 lazy_load = false 可改回每次 rerun 全部載入
     try:
-        client = get_google_sheet_connection()
-        sheet_url = st.secrets["sheets"]["inspect_url"]
-        sh = client.open_by_url(sheet_url)
-        worksheet = sh.get_worksheet(0)
-        rows = worksheet.get_all_values()
-        if not rows: return pd.DataFrame(columns=INSPECT_COLS)
-        header = rows[0]
-        data = rows[1:]
-        df = pd.DataFrame(data, columns=header)
-        # 處理合併儲存格
-        df.replace("", float("NaN"), inplace=True)
-        df['項目各部'] = df['項目各部'].ffill()
-        df.fillna("", inplace=True)
-        return df
-    except Exception as e:
-        return pd.DataFrame(columns=INSPECT_COLS)
+        return bool(st.secrets.get("lazy_load", True))
+    except Exception:
+        return True
 
 def save_repair_data(df):
     try:
-        client = get_google_sheet_connection()
-        sheet_url = st.secrets["sheets"]["repair_url"]
-        sh = client.open_by_url(sheet_url)
-        worksheet = sh.get_worksheet(0)
-        cols_to_save = [c for c in df.columns if c in REPAIR_COLS]
+        worksheet = get_sheet_pool().worksheet("repair")
+        cols_to_save = [c for c in df.columns if c in REPAIR_COLS or c == ID_COL]
         df_save = df[cols_to_save]
         data_to_write = [df_save.columns.values.tolist()] + df_save.values.tolist()
-        worksheet.clear()
-        worksheet.update(data_to_write)
+        with metrics.timer("save.full") as t:
+            t.count = len(df_save)
+            worksheet.clear()
+            worksheet.update(data_to_write)
+        get_sheet_pool().forget_header("repair")
+        get_snapshot_store().drop("repair")
+        load_repair_data.clear()
+        return True
+    except Exception as e:
+        get_sheet_pool().invalidate()
+        st.error(f"存檔失敗: {e}")
+        return False
+
+def record_to_row(record, header):
+    return [str(record.get(col, "")) for col in header]
+
+def save_repair_record(df, record, original=None):
+    """單筆寫入：新增為一列 append、修改只更新有變動的儲存格；交給背景佇列同步，表頭缺欄位 (結構變更) 才整表重寫"""
+    try:
+        header = get_sheet_pool().header("repair")
+        if any(col not in header for col in REPAIR_COLS + [ID_COL]):
+            if original is not None:
+                # 類別欄先轉回一般字串，改成新的機型/大標才寫得進去 (同 apply_repair_op)
+                df = df.astype(str)
+                target = df[ID_COL] == original['original_id']
+                for key, val in record.items(): df.loc[target, key] = val
+            else:
+                df = pd.concat([df, pd.DataFrame([{**record, ID_COL: new_record_id()}])], ignore_index=True)
+            # 整表重寫已包含所有本地變更，佇列中尚未送出的項目不再需要
+            get_write_queue().discard()
+            return save_repair_data(df)
+        if original is None:
+            rid = new_record_id()
+            get_write_queue().enqueue({"kind": "append", "id": rid, "record": {**record, ID_COL: rid}})
+        else:
+            changed = {col for col in header if col in record and str(record[col]) != str(original.get(col, ""))}
+            if changed:
+                merged = {col: original.get(col, "") for col in header}
+                merged.update(record)
+                get_write_queue().enqueue({"kind": "update", "id": original['original_id'], "record": merged, "cols": changed})
         load_repair_data.clear()
         return True
     except Exception as e:
+        get_sheet_pool().invalidate()
         st.error(f"存檔失敗: {e}")
         return False
 
-def delete_repair_data(index_to_delete):
+def delete_repair_data(record_id):
     try:
-        client = get_google_sheet_connection()
-        sheet_url = st.secrets["sheets"]["repair_url"]
-        sh = client.open_by_url(sheet_url)
-        worksheet = sh.get_worksheet(0)
-        worksheet.delete_rows(index_to_delete + 2)
+        get_write_queue().enqueue({"kind": "delete", "id": record_id})
         load_repair_data.clear()
         return True
     except Exception as e:
         st.error(f"刪除失敗: {e}")
         return False
 
-@st.cache_resource
-def build_search_engine(df_content):
-    if not HAS_AI or df_content.empty: return None, None
-    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(1, 3))
-    tfidf_matrix = vectorizer.fit_transform(df_content)
-    return vectorizer, tfidf_matrix
-
-def super_smart_search(query, df, vectorizer, tfidf_matrix):
-    if not query or df.empty: return pd.DataFrame(), "", ""
-    smart_query = expand_query(query)
-    scores = pd.Series([0.0] * len(df))
-    if HAS_AI and vectorizer:
-        try:
-            query_vec = vectorizer.transform([smart_query])
-            vec_scores = cosine_similarity(query_vec, tfidf_matrix).flatten()
-            scores += vec_scores * 0.6 
-        except: pass
-    if HAS_FUZZY:
-        fuzzy_scores_topic = df['主題(事件簡述)'].apply(lambda x: fuzz.token_set_ratio(query, x) / 100.0)
-        fuzzy_scores_cause = df['原因(異常查找、分析)'].apply(lambda x: fuzz.token_set_ratio(query, x) / 100.0)
-        scores += (fuzzy_scores_topic * 0.3 + fuzzy_scores_cause * 0.1)
-    keywords = query.split()
-    keyword_mask = pd.Series([0.0] * len(df))
-    for k in keywords:
-        if len(k) > 1:
-            keyword_mask += df['search_content'].str.contains(k, case=False, regex=False).astype(float)
-    scores += keyword_mask * 0.2
-    df_res = df.copy()
-    df_res['final_score'] = scores
-    results = df_res[df_res['final_score'] > 0.15].sort_values('final_score', ascending=False).head(10)
-    summary_md = ""
-    external_link = ""
-    if not results.empty:
-        best_row = None
-        for _, row in results.iterrows():
-            cause_text = str(row['原因(異常查找、分析)']).strip()
-            if len(cause_text) > 2 and cause_text not in ["無", "待處理", "未知", "nan"]:
-                best_row = row
-                break
-        if best_row is None: best_row = results.iloc[0]
-        clean_cause = clean_text(best_row['原因(異常查找、分析)'])
-        clean_topic = clean_text(best_row['主題(事件簡述)'])
-        summary_md = f"""
-        <div style="background-color: var(--secondary-background-color); padding: 15px; border-radius: 10px; border-left: 5px solid #3182CE;">
-            <h4 style="margin-top:0;">🤖 AI 診斷報告</h4>
-            <p>分析您的描述，資料庫中最相似的案例為 <b>「{clean_topic}」</b>。</p>
-            <p>👉 <b>建議檢查方向：</b><br>
-            <span style="color: var(--text-color); font-size: 1.1em; opacity: 0.9;">{clean_cause if len(clean_cause) > 1 else "暫無明確內部紀錄，建議參考下方外部搜尋。"}</span>
-            </p>
-        </div>
-        """
-        search_term = f"{best_row['設備型號']} {clean_topic} 故障排除"
-        external_link = f"https://www.google.com/search?q={search_term}"
+# === 背景寫入佇列 (先改本地快照立即回應，再合併成一次 batch_update 同步到 Google Sheet) ===
+WRITE_FLUSH_DELAY = 1.5  # 秒；等連續輸入的幾筆變更一起送出
+WRITE_MAX_RETRIES = 5
+WRITE_MAX_BACKOFF = 60
+
+def apply_repair_op(df, op):
+    sheet_cols = [c for c in df.columns if c not in REPAIR_DERIVED_COLS]
+    # 類別欄先轉回一般字串才能寫入新值，finalize_repair_frame 會再壓縮回 categorical
+    df = df[sheet_cols].astype(str)
+    if op["kind"] == "append":
+        row = {col: str(op["record"].get(col, "")) for col in sheet_cols}
+        df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
+    elif op["kind"] == "update":
+        target = df[ID_COL] == op["id"]
+        for col in op["cols"]:
+            if col in df.columns: df.loc[target, col] = str(op["record"][col])
     else:
-        summary_md = """
-        <div style="background-color: var(--secondary-background-color); padding: 15px; border-radius: 10px; border-left: 5px solid #718096;">
-            🤖 目前資料庫中找不到相似度夠高的案例。
-        </div>
-        """
-        external_link = f"https://www.google.com/search?q=設備維修 {query}"
-    return results, summary_md, external_link
+        df = df[df[ID_COL] != op["id"]].reset_index(drop=True)
+    return finalize_repair_frame(df)
+
+def _row_data(values):
+    return {"values": [{"userEnteredValue": {"stringValue": v}} for v in values]}
+
+def build_sheet_requests(ops, rows, sheet_id, header):
+    # 依佇列順序轉成 Sheets API 請求；同一次 batch_update 內依序執行，rows 為 RecordRowIndex.plan 推算的列號
+    requests = []
+    for op, row in zip(ops, rows):
+        if op["kind"] == "append":
+            requests.append({"appendCells": {"sheetId": sheet_id, "rows": [_row_data(record_to_row(op["record"], header))], "fields": "userEnteredValue"}})
+        elif op["kind"] == "update":
+            cols = [i for i, col in enumerate(header) if col in op["cols"]]
+            if not cols: continue
+            first, last = min(cols), max(cols)
+            requests.append({"updateCells": {
+                "range": {"sheetId": sheet_id, "startRowIndex": row - 1, "endRowIndex": row, "startColumnIndex": first, "endColumnIndex": last + 1},
+                "rows": [_row_data(record_to_row(op["record"], header[first:last + 1]))],
+                "fields": "userEnteredValue"
+            }})
+        else:
+            requests.append({"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": row - 1, "endIndex": row}}})
+    return requests
+
+def _is_quota_error(e):
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return isinstance(e, gspread.exceptions.APIError) and status in (429, 500, 502, 503)
+
+class RepairWriteQueue:
+    """維修紀錄的 write-behind 佇列：以紀錄ID合併同一筆的連續修改，背景批次寫回雲端，配額錯誤時退避重試
+
+    連線池由建立者傳入、列號索引由佇列自己保存：背景執行緒不呼叫 st.cache_resource。
+    """
+    def __init__(self, store, pool):
+        self._store = store
+        self.pool = pool
+        self.row_index = RecordRowIndex()
+        self._cond = threading.Condition()
+        self._ops = []
+        self._inflight = 0  # 佇列前段正在送出的筆數，這些項目不可再被合併
+        self._flushing = False  # 背景執行緒正在送出一批 (discard 要等它結束)
+        self._thread = None
+        self.last_error = None
+        # 對試算表的結構性寫入 (佇列送出、補紀錄ID) 互斥，重讀ID欄到送出之間不會被自己人插隊
+        self.sheet_lock = threading.Lock()
+
+    def pending(self):
+        with self._cond:
+            return len(self._ops)
+
+    def _coalesce(self, op):
+        queued = self._ops[self._inflight:]
+        same = [prev for prev in queued if prev["id"] == op["id"]]
+        if op["kind"] == "update" and same:
+            prev = same[-1]
+            prev["record"] = {**prev["record"], **op["record"]}
+            if prev["kind"] == "update": prev["cols"] = prev["cols"] | op["cols"]
+            return True
+        if op["kind"] == "delete" and same:
+            # 即將被刪除的紀錄，排隊中的修改都不必送出；若連新增都還沒送出，兩者直接抵銷
+            self._ops[self._inflight:] = [prev for prev in queued if prev["id"] != op["id"]]
+            return any(prev["kind"] == "append" for prev in same)
+        return False
+
+    def enqueue(self, op):
+        with self._cond:
+            self._store.hold("repair", self._overlay)
+            self._store.patch("repair", lambda df: apply_repair_op(df, op))
+            if not self._coalesce(op):
+                self._ops.append(op)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _overlay(self, df):
+        """把佇列中尚未同步的變更套到剛從雲端抓到的資料 (快照被丟掉、無處 patch 時由 SnapshotStore.load 呼叫)"""
+        with self._cond:
+            ops = list(self._ops)
+        for op in ops:
+            # 送出後、移出佇列前抓到的資料已含這筆新增，不再重複加
+            if op["kind"] == "append" and (df[ID_COL] == op["id"]).any(): continue
+            df = apply_repair_op(df, op)
+        return df
+
+    def discard(self):
+        with self._cond:
+            # 等送出中的那一批結束：否則它完成後會刪掉 discard 之後才排入的項目，
+            # 送出中的新增也可能在整表重寫之後才寫到雲端，變成重複的列
+            while self._flushing: self._cond.wait()
+            self._ops = []
+            self._inflight = 0
+            self._store.release("repair")
+
+    def _flush(self, batch):
+        with self.sheet_lock:
+            self._flush_locked(batch)
+
+    def _flush_locked(self, batch):
+        worksheet = self.pool.worksheet("repair")
+        header = self.pool.header("repair")
+        index = self.row_index
+        if not index.built or any(op["kind"] != "append" for op in batch):
+            # 要改、刪既有列 (或索引還沒建過) 時先重讀紀錄ID這一欄 (一次呼叫)：
+            # 別人直接在試算表增刪過列、或背景抓取的重建被擋下時，列號一律以雲端為準
+            ids = [rid.strip() for rid in worksheet.col_values(header.index(ID_COL) + 1)[1:]]
+            if not index.matches(ids): index.rebuild(ids)
+        rows = index.plan(batch)
+        # 雲端已經沒有這筆 (別人刪掉了)：對它的修改、刪除直接略過
+        ops = [op for op, row in zip(batch, rows) if row is not None]
+        requests = build_sheet_requests(ops, [row for row in rows if row is not None], worksheet.id, header)
+        if requests:
+            with metrics.timer("save.flush") as t:
+                t.count = len(ops)
+                worksheet.spreadsheet.batch_update({"requests": requests})
+        index.commit(ops)
+
+    def _run(self):
+        retries = 0
+        while True:
+            with self._cond:
+                while not self._ops: self._cond.wait()
+            time.sleep(WRITE_FLUSH_DELAY)
+            with self._cond:
+                self._inflight = len(self._ops)
+                batch = self._ops[:self._inflight]
+                if not batch: continue  # 等待期間被 discard 清空
+                self._flushing = True
+            try:
+                self._flush(batch)
+            except Exception as e:
+                self.pool.invalidate()
+                retries += 1
+                with self._cond:
+                    self._flushing = False
+                    self._cond.notify_all()
+                    self._inflight = 0
+                    self.last_error = str(e)
+                    if not _is_quota_error(e) and retries > WRITE_MAX_RETRIES:
+                        # 放棄尚未同步的變更，丟掉本地快照改以雲端資料為準
+                        self._ops = []
+                        self._store.release("repair")
+                        self._store.drop("repair")
+                        retries = 0
+                        continue
+                time.sleep(min(WRITE_MAX_BACKOFF, 2 ** retries))
+                continue
+            retries = 0
+            with self._cond:
+                del self._ops[:len(batch)]
+                self._flushing = False
+                self._cond.notify_all()
+                self._inflight = 0
+                self.last_error = None
+                if not self._ops: self._store.release("repair")
+
+@st.cache_resource
+def get_write_queue():
+    return RepairWriteQueue(get_snapshot_store(), get_sheet_pool())
+
+@st.cache_resource
+def get_search_index():
+    return IncrementalSearchIndex()
+
+def search_field_weights():
+    # secrets.toml 的 [search_weights] 可覆蓋預設欄位權重，例如 "處置、應對" = 2
+    try:
+        custom = dict(st.secrets.get("search_weights", {}))
+    except Exception:
+        custom = {}
+    return {**SEARCH_FIELD_WEIGHTS, **{col: float(w) for col, w in custom.items()}}
+
+def build_search_engine(df):
+    if not HAS_AI or df.empty: return None
+    index = get_search_index()
+    index.set_weights(search_field_weights())
+    return sync_search_index(index, df)
+
+# 維修履歷的 機型→大標→主題 階層索引：每個資料版本只建一次，切換選項時只查字典不再掃全表
+@st.cache_resource(max_entries=2)
+def get_repair_hierarchy(data_version, _df):
+    return build_repair_hierarchy(_df)
+
+# 維修履歷一次只畫一頁，按「載入更多」再往下加；筆數多的機型渲染與傳輸量都有上限
+REPAIR_LOG_PAGE_SIZE = 30
+
+def secret_int(name, default, minimum=1):
+    # secrets.toml 的整數設定，例如 repair_log_page_size = 50；沒設或格式錯誤時用預設值
+    try:
+        return max(minimum, int(st.secrets.get(name, default)))
+    except Exception:
+        return default
+
+# 戰情室統計：案件計數每個資料版本算一次，(篩選機型, 資料版本) 各自快取圖表節點
+@st.cache_data(max_entries=2, show_spinner=False)
+def get_topic_counts(data_version, _df):
+    return count_repair_topics(_df)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_dashboard_summary(models, data_version, node_limit, _df):
+    return dashboard_summary(get_topic_counts(data_version, _df), models, node_limit)
+
+# === 查詢結果快取 (同一行程內所有 session 共用；鍵含資料版本與欄位權重，任一改變舊結果自動失效) ===
+SEARCH_CACHE_SIZE = 256
+
+class SearchResultCache:
+    def __init__(self, max_size):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._max_size = max_size
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items: return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            version = key[1]
+            # 出現新版本時，舊版本的結果不會再被命中，直接清掉
+            for old_key in [k for k in self._items if k[1] != version]:
+                del self._items[old_key]
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+@st.cache_resource
+def get_search_cache():
+    return SearchResultCache(SEARCH_CACHE_SIZE)
+
+def cached_smart_search(query, df, engine):
+    # 欄位權重與候選數也算進版本：[search_weights]、search_candidates 改了之後舊的排名不再命中，並在下一次寫入時清掉
+    weights = tuple(sorted(engine.weight_map.items())) if engine else None
+    # secrets.toml 的 search_candidates 可調兩階段檢索的候選數 (0 表示全部比對)
+    candidates = secret_int("search_candidates", SEARCH_CANDIDATES, minimum=0)
+    key = (normalize_query(query), (repair_data_version(df), weights, candidates))
+    cache = get_search_cache()
+    hit = cache.get(key)
+    if hit is not None: return hit
+    result = super_smart_search(key[0], df, engine, candidates)
+    cache.put(key, result)
+    return result
 
 # ---------------------------------------------------------
 # 3. 頁面控制與表單 (改用 View 跳轉)
@@ -462,20 +817,59 @@ def jump_to_repair_case(model_name, case_id, category, topic):
     st.session_state['selected_model'] = model_name
     st.session_state['target_case_id'] = case_id 
 
+# 搜尋區塊包成 fragment：輸入改變時只重跑這一段，不重新載入資料與側邊欄
+@st.fragment
+def render_ai_search(df_repair, search_engine):
+    # 片段自己重跑時不經過 main()，渲染時間在這裡記
+    render_start = time.perf_counter()
+    st.markdown('<h1>🧠 設備維修智慧搜尋 <span style="font-size:1rem; color:gray;">(自動遞補最佳建議)</span></h1>', unsafe_allow_html=True)
+    # 輸入框用固定 key，值改變時不必再整頁 rerun；切換頁面回來時從 search_input_val 還原
+    if 'search_input' not in st.session_state:
+        st.session_state['search_input'] = st.session_state['search_input_val']
+    query = st.text_input("💬 故障描述", placeholder="試試看輸入：馬達異音、皮帶斷裂...", key="search_input")
+    st.session_state['search_input_val'] = query
+    if query:
+        with st.spinner("⚡ AI 深度檢索 & 外部資源比對中..."):
+            results, summary_html, ext_link = cached_smart_search(query, df_repair, search_engine)
+        st.markdown(summary_html, unsafe_allow_html=True)
+        if ext_link:
+            st.write("")
+            st.link_button("🌐 點此搜尋 Google 外部相關案例 (AI 生成關鍵字)", ext_link, type="secondary")
+        if not results.empty:
+            st.markdown("### 📋 內部相似案例")
+            for i, row in results.iterrows():
+                score_display = f"相似度: {int(row['final_score']*100)}%" if 'final_score' in row else ""
+                st.markdown(f"""
+                <div class="topic-container" style="padding:15px; border-left:5px solid #3182CE;">
+                    <div style="display:flex; justify-content:space-between;">
+                        <h3 style="margin:0; font-size:1.1rem;">🔧 {row['主題(事件簡述)']}</h3>
+                        <span style="font-size:0.8rem; background:rgba(128,128,128,0.2); padding:2px 8px; border-radius:10px;">{score_display}</span>
+                    </div>
+                    <div style="margin-top:8px; opacity:0.9;">
+                        <span style="background:rgba(128,128,128,0.1); padding:2px 6px; border-radius:4px; font-size:0.8rem;">{row['設備型號']}</span>
+                        <br><br>
+                        <b>🔴 原因：</b>{clean_text(str(row['原因(異常查找、分析)']))[:50]}...<br>
+                        <b>🟢 對策：</b>{clean_text(str(row['處置、應對']))[:50]}...
+                    </div>
+                </div>""", unsafe_allow_html=True)
+                if st.button(f"🚀 開啟此案例", key=f"jump_{i}"):
+                    jump_to_repair_case(row['設備型號'], row['original_id'], row['大標'], row['主題(事件簡述)'])
+                    st.rerun()
+        metrics.record("render.ai_search", time.perf_counter() - render_start, len(results))
+    else:
+        metrics.record("render.ai_search", time.perf_counter() - render_start, 0)
+
 # ---------------------------------------------------------
 # 4. 主程式執行
 # ---------------------------------------------------------
 def main():
-    df_repair = load_repair_data()
-    df_maintain = load_maintain_data()
-    df_inspect = load_inspect_data()
+    prefetch_sheets()
     
-    vectorizer, tfidf_matrix = build_search_engine(df_repair['search_content'])
-    
-    # 資料清單
-    all_repair_models = sorted(list(set(df_repair['設備型號'].astype(str).tolist()))) if not df_repair.empty else []
-    maintain_intervals = sorted(list(set(df_maintain['保養類型'].astype(str).tolist()))) if not df_maintain.empty else []
-    inspect_items = sorted(list(set(df_inspect['項目各部'].astype(str).tolist()))) if not df_inspect.empty else []
+    # 資料清單 (寫快照時已算好，側邊欄不必載入整張表)
+    facets = load_sidebar_facets()
+    all_repair_models = facets["repair"]["設備型號"]
+    maintain_intervals = facets["maintain"]["保養類型"]
+    inspect_items = facets["inspect"]["項目各部"]
 
     # === 側邊欄設計 ===
     with st.sidebar:
@@ -492,6 +886,12 @@ def main():
             set_view("add_edit_repair")
             st.rerun()
             
+        write_queue = get_write_queue()
+        if write_queue.pending():
+            st.caption(f"☁️ {write_queue.pending()} 筆變更同步中...")
+        if write_queue.last_error:
+            st.warning(f"⚠️ 雲端同步失敗，稍後重試：{write_queue.last_error}")
+
         st.divider()
         
         # === 1. 設備目錄 (下拉選單) ===
@@ -525,9 +925,7 @@ def main():
             
             maintain_models = []
             if sel_interval != "請選擇...":
-                maintain_models = sorted(list(set(
-                    df_maintain[df_maintain['保養類型'] == sel_interval]['型號'].astype(str).tolist()
-                )))
+                maintain_models = facets["maintain"].get('models_by_interval', {}).get(sel_interval, [])
             
             st.markdown('<span class="sidebar-label">2. 選擇機型</span>', unsafe_allow_html=True)
             sel_m_model = st.selectbox(
@@ -560,42 +958,30 @@ def main():
                     set_view("inspect_log")
                     st.rerun()
 
+        # === 效能監控 (網址加上 ?admin=1 才顯示) ===
+        if st.query_params.get("admin") == "1":
+            with st.expander("⏱️ 效能監控", expanded=False):
+                st.dataframe(metrics.summary(), hide_index=True, use_container_width=True)
+                st.download_button("⬇️ 匯出 JSON Lines", metrics.to_jsonl(), file_name="repair_app_metrics.jsonl", mime="application/x-ndjson")
+                if st.button("🧹 清除紀錄"):
+                    metrics.clear()
+                    st.rerun()
+
+    # --- 只載入目前頁面用得到的資料 (側邊欄按鈕可能剛切換頁面，所以放在側邊欄之後) ---
+    active_view = st.session_state['active_view']
+    needs = VIEW_DATA.get(active_view, set()) if lazy_loading() else {"repair", "search", "maintain", "inspect"}
+    df_repair = load_repair_data() if "repair" in needs else None
+    df_maintain = load_maintain_data() if "maintain" in needs else None
+    df_inspect = load_inspect_data() if "inspect" in needs else None
+    search_engine = build_search_engine(df_repair) if "search" in needs else None
+
     # --- 畫面路由 ---
+    render_start = time.perf_counter()
+    render_rows = None
 
     # 1. AI 搜尋
     if st.session_state['active_view'] == "ai_search":
-        st.markdown('<h1>🧠 設備維修智慧搜尋 <span style="font-size:1rem; color:gray;">(自動遞補最佳建議)</span></h1>', unsafe_allow_html=True)
-        query = st.text_input("💬 故障描述", placeholder="試試看輸入：馬達異音、皮帶斷裂...", value=st.session_state['search_input_val'])
-        if query != st.session_state['search_input_val']:
-            st.session_state['search_input_val'] = query
-            st.rerun()
-        if query:
-            with st.spinner("⚡ AI 深度檢索 & 外部資源比對中..."):
-                results, summary_html, ext_link = super_smart_search(query, df_repair, vectorizer, tfidf_matrix)
-            st.markdown(summary_html, unsafe_allow_html=True)
-            if ext_link:
-                st.write("")
-                st.link_button("🌐 點此搜尋 Google 外部相關案例 (AI 生成關鍵字)", ext_link, type="secondary")
-            if not results.empty:
-                st.markdown("### 📋 內部相似案例")
-                for i, row in results.iterrows():
-                    score_display = f"相似度: {int(row['final_score']*100)}%" if 'final_score' in row else ""
-                    st.markdown(f"""
-                    <div class="topic-container" style="padding:15px; border-left:5px solid #3182CE;">
-                        <div style="display:flex; justify-content:space-between;">
-                            <h3 style="margin:0; font-size:1.1rem;">🔧 {row['主題(事件簡述)']}</h3>
-                            <span style="font-size:0.8rem; background:rgba(128,128,128,0.2); padding:2px 8px; border-radius:10px;">{score_display}</span>
-                        </div>
-                        <div style="margin-top:8px; opacity:0.9;">
-                            <span style="background:rgba(128,128,128,0.1); padding:2px 6px; border-radius:4px; font-size:0.8rem;">{row['設備型號']}</span>
-                            <br><br>
-                            <b>🔴 原因：</b>{clean_text(str(row['原因(異常查找、分析)']))[:50]}...<br>
-                            <b>🟢 對策：</b>{clean_text(str(row['處置、應對']))[:50]}...
-                        </div>
-                    </div>""", unsafe_allow_html=True)
-                    if st.button(f"🚀 開啟此案例", key=f"jump_{i}"):
-                        jump_to_repair_case(row['設備型號'], row['original_id'], row['大標'], row['主題(事件簡述)'])
-                        st.rerun()
+        render_ai_search(df_repair, search_engine)
 
     # 2. 戰情室
     elif st.session_state['active_view'] == "dashboard":
@@ -605,26 +991,24 @@ def main():
         else:
             with st.expander("⚙️ 圖表資料篩選", expanded=True):
                 selected_models_chart = st.multiselect("選擇分析機型 (預設全選，可點擊 X 移除)", all_repair_models, default=all_repair_models)
-                df_chart = df_repair[df_repair['設備型號'].isin(selected_models_chart)]
+            # 機型順序不影響統計，排序後當快取鍵
+            summary = get_dashboard_summary(tuple(sorted(selected_models_chart)), repair_data_version(df_repair), secret_int("dashboard_node_limit", DASHBOARD_NODE_LIMIT), df_repair)
             st.divider()
-            if not df_chart.empty:
+            if summary["cases"]:
+                render_rows = len(summary["treemap"])
                 m1, m2, m3 = st.columns(3)
-                m1.metric("案件數", len(df_chart))
-                m2.metric("機型數", df_chart['設備型號'].nunique())
-                m3.metric("分類數", df_chart['大標'].nunique())
+                m1.metric("案件數", summary["cases"])
+                m2.metric("機型數", summary["models"])
+                m3.metric("分類數", summary["cats"])
                 COLOR_PALETTE = ['#334155', '#0F766E', '#1E40AF', '#3730A3', '#166534', '#9A3412']
                 st.markdown("### 🟠 設備異常總覽 (矩形圖)")
-                df_treemap = df_chart.copy()
-                def split_text(text): return "<br>".join([str(text)[i:i+6] for i in range(0, len(str(text)), 6)])
-                df_treemap['display_text'] = df_treemap['主題(事件簡述)'].apply(split_text)
-                fig_tree = px.treemap(df_treemap, path=[px.Constant("全廠"), '設備型號', '大標', 'display_text'], color='大標', color_discrete_sequence=COLOR_PALETTE)
+                fig_tree = px.treemap(summary["treemap"], path=[px.Constant("全廠"), '設備型號', '大標', 'display_text'], values='次數', color='大標', color_discrete_sequence=COLOR_PALETTE)
                 fig_tree.update_traces(textinfo="label+value", textposition="middle center", textfont=dict(size=16, family="Microsoft JhengHei", color="white", weight='bold'), hovertemplate='<b>%{label}</b><br>次數: %{value}<extra></extra>', marker=dict(line=dict(width=1, color='white')))
                 fig_tree.update_layout(margin=dict(t=50, l=10, r=10, b=10), height=600, uniformtext=dict(minsize=10, mode=False))
                 st.plotly_chart(fig_tree, use_container_width=True)
                 st.divider()
                 st.markdown("### 🔥 Top 20 高頻異常原因")
-                top_issues = df_chart['主題(事件簡述)'].value_counts().head(20).reset_index()
-                top_issues.columns = ['主題', '次數']
+                top_issues = summary["top_issues"]
                 fig_bar = px.bar(top_issues, x='次數', y='主題', orientation='h', text='次數', color='次數', color_continuous_scale='Greys')
                 fig_bar.update_traces(textfont=dict(weight='bold', size=14), marker_line_color='rgb(8,48,107)', marker_line_width=1, opacity=0.9)
                 fig_bar.update_layout(yaxis=dict(autorange="reversed", tickfont=dict(weight='bold')), xaxis=dict(title="發生次數", tickfont=dict(weight='bold')), height=600, coloraxis_showscale=False)
@@ -642,41 +1026,51 @@ def main():
             st.stop()
             
         st.markdown(f'<h1>📄 {target_model} 維修履歷</h1>', unsafe_allow_html=True)
-        df_model = df_repair[df_repair['設備型號'] == target_model]
+        hierarchy = get_repair_hierarchy(repair_data_version(df_repair), df_repair)
+        node = hierarchy["models"].get(target_model, {"rows": [], "topics": {}, "cats": {}})
         
         st.markdown("### 1️⃣ 選擇分類")
-        all_cats = sorted(list(set(df_model['大標'].tolist())))
+        all_cats = list(node["cats"])
         cats_display = ["全部顯示"] + all_cats
         idx_cat = cats_display.index(target_cat) if target_cat in cats_display else 0
         sel_cat = st.radio("大標", cats_display, index=idx_cat, horizontal=True, label_visibility="collapsed", key="cat_filter")
         st.session_state['target_category'] = sel_cat
-        df_l1 = df_model if sel_cat == "全部顯示" else df_model[df_model['大標'] == sel_cat]
+        level = node if sel_cat == "全部顯示" else node["cats"][sel_cat]
 
-        if not df_l1.empty:
+        topic_groups = {}
+        if len(level["rows"]):
             st.divider()
             st.markdown("### 2️⃣ 選擇主題")
-            all_topics = sorted(list(set(df_l1['主題(事件簡述)'].tolist())))
+            all_topics = list(level["topics"])
             topics_display = ["全部顯示"] + all_topics
             idx_topic = topics_display.index(target_topic) if target_topic in topics_display else 0
             sel_topic = st.radio("主題", topics_display, index=idx_topic, horizontal=True, label_visibility="collapsed", key="topic_filter")
             st.session_state['target_topic'] = sel_topic
-            df_final = df_l1 if sel_topic == "全部顯示" else df_l1[df_l1['主題(事件簡述)'] == sel_topic]
-        else:
-            df_final = pd.DataFrame()
+            topic_groups = level["topics"] if sel_topic == "全部顯示" else {sel_topic: level["topics"][sel_topic]}
             
         st.divider()
-        if df_final.empty:
+        if not topic_groups:
             st.info("此分類下無資料")
         else:
-            if target_id is not None:
-                target_row = df_final[df_final['original_id'] == target_id]
-                other_rows = df_final[df_final['original_id'] != target_id]
-                df_final = pd.concat([target_row, other_rows])
-
-            grouped = df_final.groupby('主題(事件簡述)', sort=False)
+            # AI 精選的那筆排在第一組第一筆，永遠在第一頁
+            grouped = order_topic_groups(topic_groups, hierarchy["positions"].get(target_id))
+            total_rows = sum(len(rows) for _, rows in grouped)
+            page_size = secret_int("repair_log_page_size", REPAIR_LOG_PAGE_SIZE)
+            # 換機型、分類、主題或精選案例時回到第一頁
+            page_key = (target_model, sel_cat, sel_topic, target_id)
+            if st.session_state.get('repair_log_page_key') != page_key:
+                st.session_state['repair_log_page_key'] = page_key
+                st.session_state['repair_log_shown'] = page_size
+            shown = min(st.session_state['repair_log_shown'], total_rows)
+            render_rows = shown
             
-            for topic_name, group_data in grouped:
-                st.markdown(f"""<div class="topic-container"><div class="topic-header"><span>📌 {topic_name}</span><span class="badge">{len(group_data)} 筆紀錄</span></div>""", unsafe_allow_html=True)
+            remaining = shown
+            for topic_name, rows in grouped:
+                if remaining <= 0: break
+                group_data = df_repair.iloc[rows[:remaining]]
+                remaining -= len(group_data)
+                count_text = f"{len(rows)} 筆紀錄" if len(group_data) == len(rows) else f"{len(group_data)} / {len(rows)} 筆紀錄"
+                st.markdown(f"""<div class="topic-container"><div class="topic-header"><span>📌 {topic_name}</span><span class="badge">{count_text}</span></div>""", unsafe_allow_html=True)
                 for idx, row in group_data.iterrows():
                     is_target = (row['original_id'] == target_id)
                     row_class = "highlight-record" if is_target else ""
@@ -696,26 +1090,25 @@ def main():
                     st.markdown("<hr style='margin:0; border:0; border-top:1px solid rgba(128,128,128,0.1);'>", unsafe_allow_html=True)
                 st.markdown("</div>", unsafe_allow_html=True)
 
+            if shown < total_rows:
+                st.caption(f"已顯示 {shown} / {total_rows} 筆")
+                if st.button(f"⬇️ 載入更多 ({min(page_size, total_rows - shown)} 筆)", key="repair_log_more", use_container_width=True):
+                    st.session_state['repair_log_shown'] = shown + page_size
+                    st.rerun()
+
     # 4. 保養資料
     elif st.session_state['active_view'] == "maintenance_log":
         m_interval = st.session_state['selected_maintain_interval']
         m_model = st.session_state['selected_maintain_model']
         st.markdown(f'<h1>🛠️ 保養料件清單</h1>', unsafe_allow_html=True)
         st.info(f"當前檢視：**{m_interval}** - **{m_model}**")
-        df_m_show = df_maintain[(df_maintain['保養類型'] == m_interval) & (df_maintain['型號'] == m_model)]
-        if df_m_show.empty:
+        color_rules = get_part_color_rules()
+        m_lists = get_maintain_lists(data_version(df_maintain), color_rules.version, df_maintain, color_rules)
+        if (m_interval, m_model) not in m_lists:
             st.warning("⚠️ 查無此機型的保養料件資料")
         else:
-            parts_list = df_m_show['更換料件'].tolist()
-            st.markdown('<div style="background-color: white; border-radius: 10px; box-shadow: 0 4px 6px rgba(0,0,0,0.05); padding: 5px;">', unsafe_allow_html=True)
-            for part in parts_list:
-                items = part.split('\n')
-                for item in items:
-                    item_clean = item.strip()
-                    if item_clean:
-                        color_class, icon = get_part_color_class(item_clean, m_model, m_interval)
-                        st.markdown(f"""<div class="list-item"><span class="list-icon">{icon}</span><span class="list-text {color_class}">{item_clean}</span></div>""", unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
+            render_rows, list_html = m_lists[(m_interval, m_model)]
+            st.markdown(list_html, unsafe_allow_html=True)
             if st.button("⬅️ 返回中控台"):
                 set_view("ai_search")
                 st.rerun()
@@ -725,25 +1118,12 @@ def main():
         i_item = st.session_state['selected_inspect_item']
         st.markdown(f'<h1>📋 {i_item} - 點檢細節</h1>', unsafe_allow_html=True)
         
-        df_i_show = df_inspect[df_inspect['項目各部'] == i_item]
-        
-        if df_i_show.empty:
+        i_lists = get_inspect_lists(data_version(df_inspect), df_inspect)
+        if i_item not in i_lists:
             st.warning("⚠️ 查無資料")
         else:
-            details_list = df_i_show['各部細項'].tolist()
-            st.markdown('<div style="background-color: white; border-radius: 10px; box-shadow: 0 4px 6px rgba(0,0,0,0.05); padding: 5px;">', unsafe_allow_html=True)
-            for detail in details_list:
-                lines = str(detail).split('\n')
-                for line in lines:
-                    line_clean = line.strip()
-                    if line_clean:
-                        st.markdown(f"""
-                        <div class="list-item">
-                            <span class="list-icon">🔍</span>
-                            <span class="list-text text-normal">{line_clean}</span>
-                        </div>
-                        """, unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
+            render_rows, list_html = i_lists[i_item]
+            st.markdown(list_html, unsafe_allow_html=True)
             
             if st.button("⬅️ 返回中控台"):
                 set_view("ai_search")
@@ -756,8 +1136,8 @@ def main():
         st.markdown(f"<h1>{form_title}</h1>", unsafe_allow_html=True)
         
         # 準備資料
-        existing_models = sorted(list(set(df_repair['設備型號'].astype(str).tolist()))) if not df_repair.empty else []
-        existing_cats = sorted(list(set(df_repair['大標'].astype(str).tolist()))) if not df_repair.empty else []
+        existing_models = facet_values(df_repair, '設備型號')
+        existing_cats = facet_values(df_repair, '大標')
         model_options = existing_models + ["➕ 手動輸入"]
         cat_options = existing_cats + ["➕ 手動輸入"]
         
@@ -816,12 +1196,10 @@ def main():
 
             if submitted:
                 if is_edit and delete_check:
-                    with st.spinner("🗑️ 正在刪除..."):
-                        if delete_repair_data(default_data['original_id']):
-                            st.success("已刪除！")
-                            time.sleep(1)
-                            set_view("repair_log")
-                            st.rerun()
+                    if delete_repair_data(default_data['original_id']):
+                        st.toast("🗑️ 已刪除，背景同步到 Google Sheet 中")
+                        set_view("repair_log")
+                        st.rerun()
                 elif not final_model or not new_topic:
                     st.error("⚠️ 「設備型號」與「主題」為必填欄位！")
                 else:
@@ -835,23 +1213,17 @@ def main():
                         '備註(建議事項及補充事項)': new_rem
                     }
                     
-                    with st.spinner("💾 正在儲存到 Google Sheet..."):
-                        # 更新 DataFrame
-                        if is_edit:
-                            target_idx = default_data['original_id']
-                            for key, val in new_record.items(): df_repair.at[target_idx, key] = val
-                        else:
-                            new_row_df = pd.DataFrame([new_record])
-                            df_repair = pd.concat([df_repair, new_row_df], ignore_index=True)
-                        
-                        # 寫入雲端
-                        if save_repair_data(df_repair):
-                            st.success("✅ 儲存成功！")
-                            time.sleep(1)
-                            # 儲存後跳轉回列表查看
-                            st.session_state['selected_model'] = final_model
-                            set_view("repair_log")
-                            st.rerun()
+                    # 本地立即生效，雲端由背景佇列同步
+                    if save_repair_record(df_repair, new_record, default_data if is_edit else None):
+                        st.toast("✅ 已儲存，背景同步到 Google Sheet 中")
+                        # 儲存後跳轉回列表查看
+                        st.session_state['selected_model'] = final_model
+                        set_view("repair_log")
+                        st.rerun()
+
+    # AI 搜尋由片段自己記錄；中途 st.rerun()/st.stop() 的那一輪不記
+    if active_view != "ai_search":
+        metrics.record(f"render.{active_view}", time.perf_counter() - render_start, render_rows)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,116 @@
+"""批次搜尋：整批工單描述一次比對歷史維修紀錄，結果以 JSON Lines 逐筆輸出 (不需啟動 Streamlit)
+
+用法：
+    python batch_search.py tickets.csv --column 描述 --output results.jsonl
+    python batch_search.py tickets.txt --workers 8            # 純文字檔：一行一筆描述
+    python batch_search.py tickets.csv --corpus 維修紀錄.csv   # 不用本地快照，改用匯出的 CSV
+"""
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import pandas as pd
+
+import repair_core
+from repair_core import (
+    HAS_AI, REPAIR_COLS, ID_COL, SNAPSHOT_DIR, SEARCH_INDEX_DIR, SEARCH_TOP_K, SEARCH_CANDIDATES,
+    SnapshotStore, IncrementalSearchIndex, sync_search_index,
+    clean_text, expand_query, finalize_repair_frame, rank_records, pick_best_row,
+)
+
+# === 語料與工單讀取 ===
+def load_corpus(path=None):
+    """預設讀網頁存下的本地快照；指定 CSV (試算表匯出) 時做與網頁相同的整理"""
+    if path is None:
+        df = SnapshotStore(SNAPSHOT_DIR).read("repair")
+        if df is None:
+            raise SystemExit(f"找不到本地快照 ({SNAPSHOT_DIR})，請先開啟網頁載入一次資料，或用 --corpus 指定 CSV")
+        return df
+    if path.endswith(".pkl"): return pd.read_pickle(path)
+    df = pd.read_csv(path, dtype=str).fillna("")
+    missing = [c for c in REPAIR_COLS if c not in df.columns]
+    if missing: raise SystemExit(f"CSV 缺少欄位：{', '.join(missing)}")
+    if ID_COL not in df.columns: df[ID_COL] = ""
+    df = df[REPAIR_COLS + [ID_COL]].apply(lambda col: col.str.strip())
+    # 沒有紀錄ID的列以列號代替，父子行程算出的語料雜湊才會一致
+    blank = df[ID_COL] == ""
+    df.loc[blank, ID_COL] = [f"row-{i}" for i in df.index[blank]]
+    return finalize_repair_frame(df)
+
+def _numbered_lines(lines):
+    # 先編號再略過空白行，row 才對得回輸入的第幾行
+    return [(row, line.strip()) for row, line in enumerate(lines) if line.strip()]
+
+def load_tickets(path, column=None):
+    """[(row, 描述)]：row 是在輸入中的位置 (從 0 起算；純文字檔是行號，含被略過的空白行；CSV 是資料列)"""
+    if path == "-": return _numbered_lines(sys.stdin)
+    if path.endswith(".csv"):
+        df = pd.read_csv(path, dtype=str).fillna("")
+        column = column or df.columns[0]
+        if column not in df.columns: raise SystemExit(f"工單檔沒有欄位：{column}")
+        return list(enumerate(df[column].str.strip().tolist()))
+    with open(path, encoding="utf-8") as f:
+        return _numbered_lines(f)
+
+# === 比對 (每個子行程各自持有一份語料與索引) ===
+_worker = {}
+
+def init_worker(corpus_path, index_dir, top_k, candidates, fuzzy_workers):
+    # 父行程已把索引寫到磁碟，子行程以語料雜湊直接讀檔，不重新分析文字
+    repair_core.FUZZY_WORKERS = fuzzy_workers
+    df = load_corpus(corpus_path)
+    _worker.update(df=df, engine=sync_search_index(IncrementalSearchIndex(index_dir), df) if HAS_AI and not df.empty else None, top_k=top_k, candidates=candidates)
+
+def match_ticket(item):
+    row, query = item
+    df, engine = _worker['df'], _worker['engine']
+    results = rank_records(query, df, engine, _worker['candidates'], top_k=_worker['top_k']) if query else pd.DataFrame()
+    record = {"row": row, "query": query, "expanded_query": expand_query(query), "suggested_cause": "", "results": []}
+    if not results.empty:
+        record["suggested_cause"] = clean_text(pick_best_row(results)['原因(異常查找、分析)'])
+        record["results"] = [{
+            "id": r[ID_COL],
+            "model": r['設備型號'],
+            "topic": r['主題(事件簡述)'],
+            "cause": r['原因(異常查找、分析)'],
+            "action": r['處置、應對'],
+            "score": round(float(r['final_score']), 4),
+        } for _, r in results.iterrows()]
+    return json.dumps(record, ensure_ascii=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次比對工單描述與歷史維修紀錄，輸出 JSON Lines")
+    parser.add_argument("tickets", help="工單檔 (.csv 或一行一筆的純文字檔，- 表示標準輸入)")
+    parser.add_argument("--column", help="CSV 中描述所在的欄位 (預設第一欄)")
+    parser.add_argument("--corpus", help="維修紀錄 CSV/pickle (預設使用網頁的本地快照)")
+    parser.add_argument("--index-dir", default=SEARCH_INDEX_DIR, help="搜尋索引存放目錄")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="平行的行程數")
+    parser.add_argument("--top-k", type=int, default=SEARCH_TOP_K, help="每筆工單輸出幾筆相似案例")
+    parser.add_argument("--candidates", type=int, default=SEARCH_CANDIDATES, help="兩階段檢索的候選數，0 表示全部比對")
+    parser.add_argument("--output", help="輸出檔 (預設標準輸出)")
+    args = parser.parse_args(argv)
+
+    tickets = load_tickets(args.tickets, args.column)
+    # 先在父行程建好並寫出索引，子行程啟動時只需讀檔
+    df = load_corpus(args.corpus)
+    if HAS_AI and not df.empty:
+        index = IncrementalSearchIndex(args.index_dir)
+        sync_search_index(index, df)
+        index.persist()
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.workers <= 1:
+            init_worker(args.corpus, args.index_dir, args.top_k, args.candidates, repair_core.FUZZY_WORKERS)
+            for line in map(match_ticket, tickets): out.write(line + "\n")
+        else:
+            # 行程間已平行，模糊比對不再另開執行緒，避免超額使用 CPU
+            with Pool(args.workers, initializer=init_worker, initargs=(args.corpus, args.index_dir, args.top_k, args.candidates, 1)) as pool:
+                for line in pool.imap(match_ticket, tickets, chunksize=16):
+                    out.write(line + "\n")
+    finally:
+        if out is not sys.stdout: out.close()
+
+if __name__ == "__main__":
+    main()
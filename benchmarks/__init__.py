@@ -0,0 +1 @@
+"""效能基準測試：合成資料 + 記憶體內的假 gspread，量測各階段耗時與記憶體峰值"""
@@ -0,0 +1,36 @@
+"""記憶體內的 gspread 替身：只實作 app 讀取時用到的方法，不連網"""
+
+class FakeWorksheet:
+    def __init__(self, rows, sheet_id=0):
+        self.rows = rows
+        self.id = sheet_id
+
+    def get_all_values(self):
+        # 與 gspread 一樣每次都回傳新的串列，解析成本才算在讀取端
+        return [list(row) for row in self.rows]
+
+    def get_all_records(self, numericise_ignore=()):
+        # 假資料本來就全是字串，numericise_ignore 只是讓呼叫方式與 gspread 相同
+        header = self.rows[0]
+        return [dict(zip(header, row)) for row in self.rows[1:]]
+
+    def row_values(self, row):
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        return [row[col - 1] if col <= len(row) else "" for row in self.rows]
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def get_worksheet(self, index):
+        return self._worksheet
+
+class FakeClient:
+    """open_by_url(網址) 對應到預先放好的工作表"""
+    def __init__(self, sheets):
+        self._sheets = {url: FakeSpreadsheet(FakeWorksheet(rows, i)) for i, (url, rows) in enumerate(sheets.items())}
+
+    def open_by_url(self, url):
+        return self._sheets[url]
@@ -0,0 +1,163 @@
+"""各階段效能量測：讀表整理、快照、索引建立/讀檔/增量更新、搜尋、戰情室統計
+
+用法 (在專案根目錄執行)：
+    python -m benchmarks.run                               # 1k / 10k / 100k 筆
+    python -m benchmarks.run --sizes 1000 10000 --save bench.json
+    python -m benchmarks.run --compare bench.json          # 任一階段比基準慢超過門檻就回傳非 0
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import plotly.express as px
+
+from repair_core import (
+    HAS_AI, SnapshotStore, IncrementalSearchIndex, sync_search_index,
+    normalize_repair_records, normalize_maintain_rows, normalize_inspect_rows, finalize_repair_frame,
+    super_smart_search, facet_values, count_repair_topics, dashboard_summary,
+)
+from benchmarks import synthetic
+from benchmarks.fake_gspread import FakeClient
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+NOISE_FLOOR = 0.005  # 5 ms 以下的差異視為雜訊，不算退步
+
+# === 各階段 (ctx 保存前面階段的產出，每個階段可重複執行) ===
+def stage_fetch_repair(ctx):
+    worksheet = ctx['client'].open_by_url("repair").get_worksheet(0)
+    ctx['df'] = finalize_repair_frame(normalize_repair_records(worksheet.get_all_records(numericise_ignore=['all'])))
+
+def stage_fetch_maintain(ctx):
+    normalize_maintain_rows(ctx['client'].open_by_url("maintain").get_worksheet(0).get_all_values())
+
+def stage_fetch_inspect(ctx):
+    normalize_inspect_rows(ctx['client'].open_by_url("inspect").get_worksheet(0).get_all_values())
+
+def stage_snapshot(ctx):
+    store = SnapshotStore(ctx['tmp'])
+    store.write("repair", ctx['df'])
+    store.read("repair")
+
+def stage_index_build(ctx):
+    # 全新的索引目錄，量的是冷啟動完整分析加上寫檔
+    index = IncrementalSearchIndex(tempfile.mkdtemp(dir=ctx['tmp']))
+    ctx['engine'] = sync_search_index(index, ctx['df'])
+    ctx['index'] = index
+    index.persist()
+
+def stage_index_load(ctx):
+    sync_search_index(IncrementalSearchIndex(ctx['index'].index_dir), ctx['df'])
+
+def stage_index_update(ctx):
+    # 改一筆紀錄的內容同步後再改回來，兩次都只應重新分析那一筆
+    df = ctx['df'].copy()
+    df['處置、應對'] = df['處置、應對'].astype(str)
+    df.iloc[len(df) // 2, df.columns.get_loc('處置、應對')] += f" 更新{time.perf_counter_ns()}"
+    ctx['engine'] = sync_search_index(ctx['index'], df)
+    ctx['engine'] = sync_search_index(ctx['index'], ctx['df'])
+
+def stage_search(ctx):
+    for query in ctx['queries']:
+        super_smart_search(query, ctx['df'], ctx['engine'])
+
+def stage_dashboard(ctx):
+    # 與 main() 戰情室相同：先計數再畫圖 (不含快取，量的是換篩選後第一次的成本)
+    df = ctx['df']
+    summary = dashboard_summary(count_repair_topics(df), facet_values(df, '設備型號'))
+    px.treemap(summary['treemap'], path=[px.Constant("全廠"), '設備型號', '大標', 'display_text'], values='次數', color='大標')
+    px.bar(summary['top_issues'], x='次數', y='主題', orientation='h', text='次數', color='次數')
+
+STAGES = [
+    ("fetch_repair", stage_fetch_repair, False),
+    ("fetch_maintain", stage_fetch_maintain, False),
+    ("fetch_inspect", stage_fetch_inspect, False),
+    ("snapshot", stage_snapshot, False),
+    ("index_build", stage_index_build, True),
+    ("index_load", stage_index_load, True),
+    ("index_update", stage_index_update, True),
+    ("search", stage_search, False),
+    ("dashboard", stage_dashboard, False),
+]
+
+# === 量測 ===
+def measure(func, ctx, repeat, memory):
+    """回傳 (最佳耗時秒數, 記憶體峰值 bytes)；記憶體另跑一次，tracemalloc 的額外開銷不算進耗時"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(ctx)
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        func(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+def run_size(n, repeat, memory, queries, seed, verbose=True):
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = {
+            'tmp': tmp,
+            'queries': synthetic.sample_queries(queries, seed),
+            'client': FakeClient({
+                "repair": synthetic.repair_rows(n, seed),
+                "maintain": synthetic.maintain_rows(n, seed),
+                "inspect": synthetic.inspect_rows(n, seed),
+            }),
+        }
+        results = {}
+        for name, func, needs_index in STAGES:
+            if needs_index and not HAS_AI: continue
+            seconds, peak = measure(func, ctx, repeat, memory)
+            if name == "search": seconds /= len(ctx['queries'])  # 搜尋回報單次查詢的平均
+            results[name] = {"seconds": seconds, "peak_bytes": peak}
+            if verbose: print(f"{n:>8} {name:<15} {seconds * 1000:>10.1f} ms {'' if peak is None else f'{peak / 2**20:>9.1f} MiB'}", flush=True)
+        return results
+
+def compare(results, baseline, threshold):
+    """列出比基準慢超過 threshold 倍的階段"""
+    regressions = []
+    for size, stages in results.items():
+        for name, cur in stages.items():
+            base = baseline.get(size, {}).get(name)
+            if not base: continue
+            if cur['seconds'] > base['seconds'] * threshold and cur['seconds'] - base['seconds'] > NOISE_FLOOR:
+                regressions.append(f"{size} {name}: {base['seconds'] * 1000:.1f} ms -> {cur['seconds'] * 1000:.1f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="維修紀錄系統各階段效能量測 (合成資料，不連 Google Sheet)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="維修紀錄筆數")
+    parser.add_argument("--repeat", type=int, default=1, help="每階段執行幾次取最快")
+    parser.add_argument("--queries", type=int, default=20, help="搜尋階段的查詢數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="不量記憶體峰值 (省下一半時間)")
+    parser.add_argument("--save", help="結果存成 JSON，之後可當 --compare 的基準")
+    parser.add_argument("--compare", help="與先前 --save 的結果比較")
+    parser.add_argument("--threshold", type=float, default=1.25, help="比基準慢幾倍算退步")
+    args = parser.parse_args(argv)
+
+    # 先用小資料跑一輪暖身，第一次呼叫的模組載入成本不算進第一個尺寸
+    run_size(200, 1, False, 2, args.seed, verbose=False)
+    print(f"{'rows':>8} {'stage':<15} {'time':>13} {'peak':>13}")
+    results = {str(n): run_size(n, args.repeat, not args.no_memory, args.queries, args.seed) for n in args.sizes}
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions: print("退步：" + line)
+        if regressions: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
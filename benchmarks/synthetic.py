@@ -0,0 +1,97 @@
+"""合成維修、保養、點檢工作表 (欄位與 REPAIR_COLS / MAINTAIN_COLS / INSPECT_COLS 相同)
+
+機型與故障類型依長尾分布抽樣，少數機型、少數常見故障佔大多數案件，與實際紀錄的分布接近。
+同一個 seed 產生的資料完全相同，前後兩次量測才能比較。
+"""
+import random
+
+from repair_core import REPAIR_COLS, MAINTAIN_COLS, INSPECT_COLS, ID_COL
+
+MODELS = [
+    "420單向軸承", "HGT-421", "HGT-300", "HGT-520", "DK-2000", "DK-3100", "CNC-850", "CNC-1200",
+    "AP-60 自動包裝機", "RB-7 機械手臂", "FX-90 輸送線", "TS-33 貼標機", "SP-210 沖床", "LM-45 雷射切割機",
+]
+CATEGORIES = ["機構", "電控", "氣壓", "油壓", "軟體", "耗材", "其他"]
+
+# (部件, 症狀, 原因, 處置, 驗證, 分類)
+FAULTS = [
+    ("馬達", "異音", "軸承磨損、潤滑不足", "更換軸承並補充潤滑脂", "空轉 30 分鐘確認無異音", "機構"),
+    ("馬達", "過熱", "散熱風扇積塵，負載過高", "清潔風扇濾網，調整負載", "量測外殼溫度低於 60 度", "電控"),
+    ("皮帶", "斷裂", "皮帶老化龜裂，張力過大", "更換皮帶並重新調整張力", "試車 2 小時無打滑", "機構"),
+    ("皮帶", "打滑", "張力不足，皮帶輪沾油", "清潔皮帶輪，調整張力", "轉速量測正常", "機構"),
+    ("光電感應器", "失效", "鏡面髒污，固定座鬆動", "清潔鏡面並鎖緊固定座", "遮光測試 20 次皆有反應", "電控"),
+    ("近接開關", "誤動作", "感應距離偏移，線材破皮", "重新調整距離並更換線材", "連續運轉無誤報", "電控"),
+    ("飛板", "無法驅動", "驅動板電容鼓包", "更換驅動板", "上電後各軸動作正常", "電控"),
+    ("保險絲", "燒斷", "電源突波，馬達短路", "更換保險絲並檢查馬達絕緣", "絕緣電阻量測合格", "電控"),
+    ("氣缸", "動作緩慢", "電磁閥卡滯，氣壓不足", "清潔電磁閥，調整調壓閥至 6 kg", "往復 50 次動作順暢", "氣壓"),
+    ("電磁閥", "漏氣", "O 型環老化", "更換 O 型環", "保壓測試 10 分鐘無壓降", "氣壓"),
+    ("油壓缸", "漏油", "油封破損", "更換油封", "保壓測試無滲漏", "油壓"),
+    ("油壓泵", "壓力不足", "濾網堵塞，油品劣化", "更換濾網與液壓油", "壓力錶讀值恢復 70 bar", "油壓"),
+    ("齒輪箱", "卡死", "齒面崩牙，異物卡入", "更換齒輪並清除異物", "手動盤車順暢", "機構"),
+    ("鏈條", "跳齒", "鏈條伸長，鏈輪磨耗", "更換鏈條與鏈輪", "運轉 1 小時無跳齒", "機構"),
+    ("PLC", "當機", "程式版本不符，記憶體錯誤", "重新燒錄程式", "連續生產一班無異常", "軟體"),
+    ("人機介面", "無法操作", "觸控面板校正偏移", "重新校正觸控", "各按鍵操作正常", "軟體"),
+    ("刀具", "崩刃", "進給速度過快", "更換刀具並調降進給", "試切 10 件尺寸合格", "耗材"),
+    ("吸盤", "吸不起料", "真空管路破損", "更換真空管", "真空度量測達 -80 kPa", "耗材"),
+    ("伺服驅動器", "過電流警報", "編碼器線接觸不良", "重新壓接編碼器線", "清除警報後運轉正常", "電控"),
+    ("冷卻水路", "溫度異常", "水垢堵塞", "清洗水路並加裝過濾器", "出水溫度穩定", "其他"),
+]
+CONTEXTS = ["開機時", "生產中", "換線後", "夜班", "保養後", "高速運轉時", "", "", ""]
+TOPIC_SUFFIX = ["", "", "", "，停機 10 分鐘", "，反覆發生", "，影響產能", "，需外修"]
+NOTES = ["無", "無", "", "建議列入每月保養項目", "備品庫存不足，已請購", "同型機台一併檢查", "廠商到廠協助處理"]
+
+MAINTAIN_TYPES = ["500K", "1M", "半年保養", "年度保養"]
+PART_CODES = ["B1556", "B2476", "T2670", "D3089", "D3530", "B695", "B992", "D2514", "T2400", "D3611", "X999", "B1008"]
+PART_NAMES = ["軸承", "皮帶", "油封", "濾網", "碳刷", "齒輪", "鏈條", "O 型環", "保險絲", "感應器", "螺絲", "彈簧"]
+INSPECT_PARTS = ["主軸", "進料機構", "出料機構", "電控箱", "氣壓系統", "油壓系統", "安全裝置", "潤滑系統"]
+INSPECT_ITEMS = ["外觀無破損", "固定螺絲無鬆動", "運轉無異音", "溫度正常", "壓力值在範圍內", "油位正常", "緊急停止功能正常", "清潔無積塵"]
+
+def _weights(n, skew=1.1):
+    # 長尾分布：第 i 名的權重約 1 / i^skew
+    return [1.0 / (i + 1) ** skew for i in range(n)]
+
+def repair_rows(n, seed=0):
+    """回傳試算表的列 (第一列是標題)，含紀錄ID欄"""
+    rng = random.Random(seed)
+    models = rng.choices(MODELS, weights=_weights(len(MODELS)), k=n)
+    faults = rng.choices(FAULTS, weights=_weights(len(FAULTS), 0.8), k=n)
+    rows = [REPAIR_COLS + [ID_COL]]
+    for i, (model, (part, symptom, cause, action, verify, category)) in enumerate(zip(models, faults)):
+        category = category if rng.random() > 0.1 else rng.choice(CATEGORIES)
+        topic = f"{rng.choice(CONTEXTS)}{part}{symptom}{rng.choice(TOPIC_SUFFIX)}"
+        if rng.random() < 0.05: cause = rng.choice(["無", "待處理", "未知"])
+        rows.append([model, category, topic, cause, action, verify, rng.choice(NOTES), f"{seed:02x}{i:010x}"])
+    return rows
+
+def maintain_rows(n, seed=0):
+    """保養表：保養類型、型號只寫在每組第一列 (模擬合併儲存格)"""
+    rng = random.Random(seed)
+    rows = [list(MAINTAIN_COLS)]
+    while len(rows) <= n:
+        rows.append([rng.choice(MAINTAIN_TYPES), rng.choices(MODELS, weights=_weights(len(MODELS)))[0], ""])
+        for _ in range(rng.randint(4, 20)):
+            part = f"{rng.choice(PART_CODES)} {rng.choice(PART_NAMES)}"
+            rows.append(["", "", part if rng.random() > 0.05 else ""])
+    return rows[:n + 1]
+
+def inspect_rows(n, seed=0):
+    rng = random.Random(seed)
+    rows = [list(INSPECT_COLS)]
+    while len(rows) <= n:
+        part = rng.choice(INSPECT_PARTS)
+        for j, item in enumerate(rng.sample(INSPECT_ITEMS, rng.randint(3, len(INSPECT_ITEMS)))):
+            rows.append([part if j == 0 else "", item])
+    return rows[:n + 1]
+
+def sample_queries(n=20, seed=0):
+    """模擬使用者輸入的查詢：口語描述、型號加症狀、少數錯字"""
+    rng = random.Random(seed)
+    spoken = ["馬達有怪聲", "皮帶 斷掉", "sensor 不動", "溫度太高", "漏水", "機器不動", "轉速 變慢", "飛板 壞掉"]
+    queries = []
+    for _ in range(n):
+        if rng.random() < 0.4:
+            queries.append(rng.choice(spoken))
+        else:
+            part, symptom = rng.choice(FAULTS)[:2]
+            queries.append(f"{rng.choice(MODELS).split()[0]} {part}{symptom}" if rng.random() < 0.5 else f"{part} {symptom}")
+    return queries
@@ -0,0 +1,1017 @@
+"""維修紀錄的資料整理與搜尋核心 (不依賴 Streamlit，網頁與批次工具共用)"""
+import os
+import time
+import threading
+import hashlib
+import json
+import glob
+import uuid
+import copy
+import csv
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pandas as pd
+import numpy as np
+
+HAS_AI = False
+HAS_FUZZY = False
+
+try:
+    import scipy.sparse as sp
+    from sklearn.feature_extraction.text import HashingVectorizer
+    HAS_AI = True
+except ImportError:
+    HAS_AI = False
+
+try:
+    from rapidfuzz import process, fuzz
+    HAS_FUZZY = True
+except ImportError:
+    HAS_FUZZY = False
+
+REPAIR_COLS = ['設備型號', '大標', '主題(事件簡述)', '原因(異常查找、分析)', '處置、應對', '驗證是否排除(驗證作法)', '備註(建議事項及補充事項)']
+MAINTAIN_COLS = ['保養類型', '型號', '更換料件']
+INSPECT_COLS = ['項目各部', '各部細項'] # 點檢表欄位
+ID_COL = '紀錄ID' # 維修紀錄的永久編號 (寫在試算表最後一欄)
+# 重複值很多的欄位存成 categorical，同時當作側邊欄/表單的選項清單
+REPAIR_FACET_COLS = ['設備型號', '大標']
+MAINTAIN_FACET_COLS = ['保養類型', '型號']
+INSPECT_FACET_COLS = ['項目各部']
+
+def clean_text(text):
+    if not isinstance(text, str): return str(text)
+    text = text.replace("**", "")
+    text = text.replace("\n", " ").strip()
+    return text
+
+def expand_query(query):
+    SYNONYMS = {
+        "聲音": "異音 噪音 吵雜 聲響", "怪聲": "異音 磨損",
+        "不動": "卡死 異常 停止 無法運作失效", "壞掉": "異常 故障 損壞",
+        "溫度": "過熱 發燙 高溫", "漏水": "洩漏 滲水",
+        "轉速": "速度 變慢", "sensor": "感應器 光電",
+        "馬達": "motor", "皮帶": "斷裂 磨損",
+        "飛板": "fly board 驅動板", 
+    }
+    q = query
+    for k, v in SYNONYMS.items():
+        if k in query.lower(): q += " " + v
+    return q
+
+
+# === 效能量測 (各階段耗時滾動保存在行程內，網頁側邊欄面板與 JSON Lines 匯出共用) ===
+METRICS_WINDOW = 2000  # 只保留最近幾筆，長時間運作也不會一直長大
+METRICS_LOG = os.environ.get("REPAIR_APP_METRICS_LOG")  # 設定時每筆量測另外附加寫入此 JSON Lines 檔，給監控系統收
+
+class StageMetrics:
+    """記錄每個階段 (fetch / normalize / index / score / render / save) 的耗時與處理筆數"""
+    def __init__(self, window=METRICS_WINDOW, log_path=METRICS_LOG):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.log_path = log_path
+
+    def record(self, stage, seconds, count=None):
+        sample = {"ts": round(time.time(), 3), "stage": stage, "ms": round(seconds * 1000, 3), "count": count}
+        with self._lock:
+            self._samples.append(sample)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+                except OSError:
+                    pass
+
+    @contextmanager
+    def timer(self, stage):
+        # with metrics.timer("stage") as t: ... t.count = 筆數
+        timing = SimpleNamespace(count=None)
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            self.record(stage, time.perf_counter() - start, timing.count)
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def summary(self):
+        """每個階段一列：次數、最近一次、平均、p95、最大耗時 (ms) 與最近一次的筆數"""
+        df = pd.DataFrame(self.samples(), columns=["ts", "stage", "ms", "count"])
+        if df.empty: return pd.DataFrame(columns=["stage", "calls", "last_ms", "mean_ms", "p95_ms", "max_ms", "last_count"])
+        by_stage = df.groupby("stage")
+        summary = pd.DataFrame({
+            "calls": by_stage["ms"].size(),
+            "last_ms": by_stage["ms"].last(),
+            "mean_ms": by_stage["ms"].mean(),
+            "p95_ms": by_stage["ms"].quantile(0.95),
+            "max_ms": by_stage["ms"].max(),
+            "last_count": by_stage["count"].last(),
+        })
+        return summary.round(1).sort_values("mean_ms", ascending=False).reset_index()
+
+    def to_jsonl(self):
+        return "".join(json.dumps(sample, ensure_ascii=False) + "\n" for sample in self.samples())
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+# 模組只會載入一次 (Streamlit 每次 rerun 只重跑 app.py)，整個行程共用這一份
+metrics = StageMetrics()
+
+
+# === 本地快照 (冷啟動先讀本地檔，Google Sheet 只在背景負責更新快照) ===
+SNAPSHOT_DIR = os.environ.get("REPAIR_APP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+SNAPSHOT_FORMAT = 6  # DataFrame 欄位結構改變時遞增，舊快照自動失效
+FACETS_MAX_AGE = 60  # 秒；只讀選項清單的頁面，清單檔超過這個時間才在背景重抓
+
+class SnapshotStore:
+    """以 pickle 檔保存各工作表整理後的 DataFrame，並在背景執行緒向雲端更新"""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._generation = {}
+        self._held = set()
+        self._overlays = {}
+        self._prefetched = {}
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f"{name}-v{SNAPSHOT_FORMAT}.pkl")
+
+    def _facets_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}-facets-v{SNAPSHOT_FORMAT}.json")
+
+    def read(self, name):
+        path = self._path(name)
+        if not os.path.exists(path): return None
+        try:
+            return pd.read_pickle(path)
+        except Exception:
+            return None
+
+    def write(self, name, df):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._path(name) + ".tmp"
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, self._path(name))  # 原子替換，讀取端不會讀到寫一半的檔案
+            # 側邊欄選項清單另存一個小檔，只要選單的頁面不必讀整份快照
+            tmp_path = self._facets_path(name) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(frame_facets(name, df), f, ensure_ascii=False)
+            os.replace(tmp_path, self._facets_path(name))
+        except Exception:
+            pass
+
+    def read_facets(self, name):
+        try:
+            with open(self._facets_path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def drop(self, name):
+        # 存檔後丟棄快照，下一次讀取會直接向 Google Sheet 拿最新資料
+        with self._lock:
+            self._generation[name] = self._generation.get(name, 0) + 1
+        for path in (self._path(name), self._facets_path(name)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def patch(self, name, func):
+        # 直接修改本地快照 (寫入佇列用來立即反映尚未同步的變更)
+        with self._lock:
+            self._generation[name] = self._generation.get(name, 0) + 1
+            df = self.read(name)
+            if df is None: return None
+            df = func(df)
+            self.write(name, df)
+            return df
+
+    def hold(self, name, overlay=None):
+        # 還有變更未同步到雲端時，背景更新不可覆蓋快照；overlay 把這些變更套到剛從雲端抓到的資料上
+        with self._lock:
+            self._held.add(name)
+            if overlay is not None: self._overlays[name] = overlay
+
+    def release(self, name):
+        with self._lock:
+            self._held.discard(name)
+            self._overlays.pop(name, None)
+            self._generation[name] = self._generation.get(name, 0) + 1
+
+    def _refresh(self, name, fetch_func, generation):
+        try:
+            df = fetch_func()
+            with self._lock:
+                # 抓取期間若有人存檔，這份資料可能已過期，不覆蓋快照
+                stale = self._generation.get(name, 0) != generation or name in self._held
+                if df is not None and not stale:
+                    self.write(name, df)
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+
+    def refresh_async(self, name, fetch_func):
+        with self._lock:
+            if name in self._refreshing or name in self._held: return
+            self._refreshing.add(name)
+            generation = self._generation.get(name, 0)
+        threading.Thread(target=self._refresh, args=(name, fetch_func, generation), daemon=True).start()
+
+    def _prefetch_one(self, name, fetch_func, generation):
+        try:
+            df = fetch_func()
+        except Exception:
+            df = None
+        with self._lock:
+            self._refreshing.discard(name)
+            if df is not None and self._generation.get(name, 0) == generation and name not in self._held:
+                self._prefetched[name] = (generation, df)
+                self.write(name, df)
+
+    def prefetch(self, sources):
+        """沒有快照的表同時向雲端抓 (sources: {名稱: fetch_func})，冷啟動只等最慢的一張
+
+        抓到的資料只留給同一次重跑裡接下來的 load() 直接取用，不會馬上又觸發一次背景更新；
+        下一次 prefetch() 先清掉沒被取走的，之後的 load() 照常讀快照並在背景更新。
+        """
+        with self._lock:
+            self._prefetched.clear()
+            jobs = [(name, func, self._generation.get(name, 0)) for name, func in sources.items()
+                    if name not in self._refreshing and name not in self._held and not os.path.exists(self._path(name))]
+            if len(jobs) < 2: return  # 只缺一張時 load() 自己抓，不必開執行緒
+            self._refreshing.update(name for name, _, _ in jobs)
+        with metrics.timer("snapshot.prefetch") as t:
+            t.count = len(jobs)
+            with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+                list(pool.map(lambda job: self._prefetch_one(*job), jobs))
+
+    def load_facets(self, name, fetch_func, empty_cols):
+        """只讀選項清單；清單檔太舊時在背景更新整份快照，沒有清單檔才當場載入"""
+        facets = self.read_facets(name)
+        if facets is None: return frame_facets(name, self.load(name, fetch_func, empty_cols))
+        try:
+            if time.time() - os.path.getmtime(self._facets_path(name)) > FACETS_MAX_AGE:
+                self.refresh_async(name, fetch_func)
+        except OSError:
+            pass
+        return facets
+
+    def load(self, name, fetch_func, empty_cols):
+        with self._lock:
+            generation, prefetched = self._prefetched.pop(name, (None, None))
+            if prefetched is not None and generation == self._generation.get(name, 0): return prefetched
+        with metrics.timer(f"snapshot.{name}"):
+            snapshot = self.read(name)
+        if snapshot is not None:
+            self.refresh_async(name, fetch_func)
+            return snapshot
+        df = fetch_func()
+        if df is None: return pd.DataFrame(columns=empty_cols)
+        with self._lock:
+            overlay = self._overlays.get(name) if name in self._held else None
+        if overlay is not None:
+            # 沒有快照時 patch() 無處可改：尚未同步的變更直接套在抓到的資料上，才不會從畫面消失
+            df = overlay(df)
+        self.write(name, df)
+        return df
+
+
+REPAIR_DERIVED_COLS = ['original_id']
+
+def new_record_id():
+    return uuid.uuid4().hex[:12]
+
+# === 紀錄ID → 試算表列號 (單筆寫入用，不必每次整欄搜尋) ===
+class RecordRowIndex:
+    """紀錄ID → 工作表列號 (第 1 列是表頭)；抓取時重建，寫入佇列送出成功後就地更新
+
+    還沒用ID欄建過 (built 為 False) 時不推算任何列號，呼叫端要先讀ID欄重建。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._next_row = 2
+        self.built = False
+        self.version = 0  # 每次寫入後遞增，較早開始的抓取結果不可覆蓋索引
+
+    def rebuild(self, ids, version=None):
+        # version：抓取開始時記下的版本，期間有寫入就放棄；None 表示 ids 是剛從試算表讀到的ID欄，直接採用
+        with self._lock:
+            if version is not None and version != self.version: return False
+            self._rows = {rid: i + 2 for i, rid in enumerate(ids)}
+            self._next_row = len(ids) + 2
+            self.built = True
+            return True
+
+    def matches(self, ids):
+        """索引與試算表目前的ID欄 (不含表頭) 是否完全一致"""
+        with self._lock:
+            if not self.built or len(ids) + 2 != self._next_row: return False
+            return all(self._rows.get(rid) == i + 2 for i, rid in enumerate(ids))
+
+    def row(self, rid):
+        with self._lock:
+            return self._rows.get(rid)
+
+    def plan(self, ops):
+        # 推算一批操作依序執行時各自的列號 (同批前面的刪除會讓後面的列往上移)，不修改索引本身
+        with self._lock:
+            if not self.built: return [None] * len(ops)
+            appended = {}
+            deleted = []
+            rows = []
+            for op in ops:
+                if op["kind"] == "append":
+                    base = self._next_row + len(appended)
+                    appended[op["id"]] = base
+                else:
+                    base = appended.get(op["id"], self._rows.get(op["id"]))
+                if base is None:
+                    rows.append(None)
+                    continue
+                rows.append(base - sum(1 for d in deleted if d < base))
+                if op["kind"] == "delete": deleted.append(base)
+            return rows
+
+    def commit(self, ops):
+        with self._lock:
+            for op in ops:
+                if op["kind"] == "append":
+                    self._rows[op["id"]] = self._next_row
+                    self._next_row += 1
+                elif op["kind"] == "delete":
+                    removed = self._rows.pop(op["id"], None)
+                    if removed is None: continue
+                    for rid, row in self._rows.items():
+                        if row > removed: self._rows[rid] = row - 1
+                    self._next_row -= 1
+            self.version += 1
+
+def compact_frame(df, facet_cols):
+    """低基數欄位轉成 categorical：每個值只存一份，categories 本身就是排序好的選單清單"""
+    for col in facet_cols:
+        if col in df.columns:
+            df[col] = df[col].astype(str).astype("category")
+    return df
+
+SHEET_FACET_COLS = {"repair": REPAIR_FACET_COLS, "maintain": MAINTAIN_FACET_COLS, "inspect": INSPECT_FACET_COLS}
+
+def frame_facets(name, df):
+    """側邊欄要的選項清單 (可存成 JSON)：各 facet 欄的值，保養表另含每種保養類型底下的型號"""
+    facets = {col: facet_values(df, col) for col in SHEET_FACET_COLS.get(name, [])}
+    if name == "maintain" and not df.empty:
+        # 每種保養類型底下有哪些型號 (側邊欄第二層選單)；寫快照時算一次，同樣不放在 df.attrs
+        facets['models_by_interval'] = {
+            str(interval): sorted(str(model) for model in models.unique())
+            for interval, models in df.groupby('保養類型', observed=True)['型號']
+        }
+    return facets
+
+def facet_values(df, col):
+    """欄位的選項清單：載入時轉好的類別欄直接取 categories，不必每次 rerun 重新排序
+
+    清單不放在 df.attrs：pandas 每次切片、複製都會深拷貝 attrs，大清單會拖慢每一次篩選。
+    """
+    if df.empty or col not in df.columns: return []
+    if isinstance(df[col].dtype, pd.CategoricalDtype):
+        return df[col].cat.categories.tolist()
+    return sorted(set(df[col].astype(str).tolist()))
+
+def normalize_repair_records(records):
+    """get_all_records() 的結果轉成 DataFrame：補齊缺少的欄位、去除前後空白 (紀錄ID由呼叫端補上)"""
+    df = pd.DataFrame(records)
+    if df.empty: return pd.DataFrame(columns=REPAIR_COLS + [ID_COL])
+    for col in REPAIR_COLS:
+        if col not in df.columns: df[col] = "無"
+    for col in df.columns:
+        df[col] = df[col].astype(str).str.strip()
+    return df
+
+def normalize_maintain_rows(rows):
+    """get_all_values() 的結果轉成 DataFrame：合併儲存格往下補值，沒有料件的列丟掉"""
+    if not rows: return pd.DataFrame(columns=MAINTAIN_COLS)
+    df = pd.DataFrame(rows[1:], columns=rows[0])
+    df.replace("", float("NaN"), inplace=True)
+    df['保養類型'] = df['保養類型'].ffill()
+    df['型號'] = df['型號'].ffill()
+    df['保養類型'] = df['保養類型'].astype(str).str.upper().str.strip()
+    df = df.dropna(subset=['更換料件'])
+    df.fillna("", inplace=True)
+    df.attrs['data_version'] = frame_version(df, MAINTAIN_COLS)
+    return compact_frame(df, MAINTAIN_FACET_COLS)
+
+def normalize_inspect_rows(rows):
+    if not rows: return pd.DataFrame(columns=INSPECT_COLS)
+    df = pd.DataFrame(rows[1:], columns=rows[0])
+    # 處理合併儲存格
+    df.replace("", float("NaN"), inplace=True)
+    df['項目各部'] = df['項目各部'].ffill()
+    df.fillna("", inplace=True)
+    df.attrs['data_version'] = frame_version(df, INSPECT_COLS)
+    return compact_frame(df, INSPECT_FACET_COLS)
+
+def frame_version(df, cols):
+    """資料版本：內容雜湊，任何一格改變都會不同 (隨 DataFrame.attrs 一起進快照與 st.cache_data)"""
+    row_hashes = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+
+def finalize_repair_frame(df):
+    df['original_id'] = df[ID_COL]
+    df.attrs['data_version'] = frame_version(df, [c for c in df.columns if c not in REPAIR_DERIVED_COLS])
+    return compact_frame(df, REPAIR_FACET_COLS)
+
+def data_version(df):
+    return df.attrs.get('data_version', "")
+
+repair_data_version = data_version
+
+# === 保養、點檢清單 (多行儲存格拆成逐行，每個資料版本拆一次) ===
+def split_lines(text):
+    return [line.strip() for line in str(text).split('\n') if line.strip()]
+
+def maintain_line_items(df, color_rules):
+    """{(保養類型, 型號): [(料件, CSS class, 圖示), ...]}，依原表順序"""
+    items = {}
+    for interval, model, parts in zip(df['保養類型'].astype(str), df['型號'].astype(str), df['更換料件']):
+        lines = items.setdefault((interval, model), [])
+        lines.extend((line, *color_rules.classify(line, model, interval)) for line in split_lines(parts))
+    return items
+
+def inspect_line_items(df):
+    """{項目各部: [細項, ...]}，依原表順序"""
+    items = {}
+    for part, details in zip(df['項目各部'].astype(str), df['各部細項']):
+        items.setdefault(part, []).extend(split_lines(details))
+    return items
+
+def build_repair_hierarchy(df):
+    """維修履歷導覽用的階層索引：設備型號 → 大標 → 主題 → 列位置 (原表順序)
+
+    每個機型與大標節點另外存「全部顯示」用的主題分組；各層的 dict 依鍵排序，直接當選單清單。
+    """
+    tree = {}
+    positions = {}
+    if df.empty: return {"models": tree, "positions": positions}
+    keys = ['設備型號', '大標', '主題(事件簡述)']
+    for model, rows in sorted(df.groupby(keys[0], observed=True).indices.items()):
+        tree[model] = {"rows": rows, "topics": {}, "cats": {}}
+    for (model, topic), rows in sorted(df.groupby([keys[0], keys[2]], observed=True).indices.items()):
+        tree[model]["topics"][topic] = rows
+    for (model, cat), rows in sorted(df.groupby(keys[:2], observed=True).indices.items()):
+        tree[model]["cats"][cat] = {"rows": rows, "topics": {}}
+    for (model, cat, topic), rows in sorted(df.groupby(keys, observed=True).indices.items()):
+        tree[model]["cats"][cat]["topics"][topic] = rows
+    positions = dict(zip(df['original_id'].tolist(), range(len(df))))
+    return {"models": tree, "positions": positions}
+
+def order_topic_groups(topics, target_pos=None):
+    """主題分組依第一次出現的順序排列；指定的那筆 (AI 精選) 所在的主題排第一、該筆排在組內第一"""
+    groups = sorted(topics.items(), key=lambda item: item[1][0])
+    if target_pos is None: return groups
+    for i, (topic, rows) in enumerate(groups):
+        if target_pos in rows:
+            rows = np.concatenate(([target_pos], rows[rows != target_pos]))
+            return [(topic, rows)] + groups[:i] + groups[i + 1:]
+    return groups
+
+# === 戰情室統計 (圖表只拿彙總後的節點，大小隨主題數而不是案件數成長) ===
+DASHBOARD_NODE_LIMIT = 150  # 矩形圖最多畫幾個主題節點，其餘併入各分類的「其他」
+DASHBOARD_TOP_N = 20
+
+def split_label(text, width=6):
+    text = str(text)
+    return "<br>".join(text[i:i + width] for i in range(0, len(text), width))
+
+def count_repair_topics(df):
+    """每個 (設備型號, 大標, 主題) 的案件數；每個資料版本算一次，換篩選機型時直接取用"""
+    keys = ['設備型號', '大標', '主題(事件簡述)']
+    counts = df.groupby(keys, observed=True, dropna=False).size().reset_index(name='次數')
+    return counts.astype({'設備型號': str, '大標': str})
+
+def dashboard_summary(counts, models, node_limit=DASHBOARD_NODE_LIMIT, top_n=DASHBOARD_TOP_N):
+    """戰情室的指標、矩形圖節點與高頻主題
+
+    矩形圖的主題節點超過 node_limit 時，次數最少的併成所在 (機型, 大標) 底下一個「其他 N 項」節點。
+    """
+    counts = counts[counts['設備型號'].isin(list(models))]
+    top_issues = (counts.groupby('主題(事件簡述)')['次數'].sum()
+                  .sort_values(ascending=False, kind='stable').head(top_n).reset_index())
+    top_issues.columns = ['主題', '次數']
+    rank = counts['次數'].rank(method='first', ascending=False)
+    kept = counts[rank <= node_limit].assign(display_text=lambda d: d['主題(事件簡述)'].map(split_label))
+    rest = counts[rank > node_limit]
+    if not rest.empty:
+        other = rest.groupby(['設備型號', '大標'], sort=False).agg(次數=('次數', 'sum'), 項數=('次數', 'size')).reset_index()
+        other['display_text'] = other['項數'].map(lambda n: f"其他 {n} 項")
+        kept = pd.concat([kept, other], ignore_index=True)
+    return {
+        "cases": int(counts['次數'].sum()),
+        "models": counts['設備型號'].nunique(),
+        "cats": counts['大標'].nunique(),
+        "treemap": kept[['設備型號', '大標', 'display_text', '次數']],
+        "top_issues": top_issues,
+    }
+
+
+# === 保養料件顏色規則 (每個 機型+保養類型 編成一個 regex，一行料件只掃一次) ===
+DEFAULT_COLOR_RULES = {
+    "420單向軸承": {
+        "500K": {
+            "red": ["B2476", "B1556", "T2400", "T2670", "D2487", "D2488", "D2510", "D3611", "D2354", "D2355", "D2356", "D2348", "D2349", "D2602", "D2362"],
+            "green": []
+        },
+        "1M": {
+            "red": ["B2476", "B1556", "T2400", "T2670", "D2487", "D2488", "D2510", "D3611", "D2354", "D2355", "D2356", "D2348", "D2349", "D2602"],
+            "green": ["B1008", "B695", "B992", "B1041", "B1054", "B993", "D3466", "D2642", "D2643", "D2443", "D2674", "D2347", "E2646", "E2647", "D2481", "D2664", "D3496", "D1614", "D3053", "D2449", "D2568", "D2340", "D2567", "D120", "D121"]
+        }
+    },
+    "HGT-421": {
+        "500K": {
+            "red": ["B1556", "B2476", "T2670", "D3089", "D3090", "D3523", "D3524", "D2602", "D3494", "D3462", "D3463", "D2487", "D2488", "D3254"],
+            "green": []
+        },
+        "1M": {
+            "red": ["B1556", "B2476", "T2670", "D3089", "D3090", "D3523", "D3524", "D2602", "D3494", "D3462", "D3463", "D2487", "D2488", "D3254"],
+            "green": ["D3530", "D3529", "B695", "B992", "D3213", "D3176", "D3181", "D2514", "D3496", "D2347", "D2510", "D3166", "D3167", "D2798", "D3215", "D2340", "E2646", "E2647", "D2481", "D2664"]
+        }
+    }
+}
+COLOR_RULES_FILE = os.environ.get("REPAIR_APP_COLOR_RULES", "")  # JSON (同上結構) 或 CSV (同規則表欄位)
+COLOR_RULE_COLS = ['型號', '保養類型', '顏色', '料號']
+COLOR_NAMES = {"red": "red", "紅": "red", "green": "green", "綠": "green"}
+
+def clean_interval(interval):
+    return str(interval).replace("保養", "").upper().strip()
+
+def parse_color_rule_rows(rows):
+    """規則表 (第一列是標題：型號、保養類型、顏色、料號) 轉成 {型號: {保養類型: {"red": [...], "green": [...]}}}
+
+    顏色填 red/green 或 紅/綠；型號、保養類型空白時沿用上一列 (合併儲存格)，料號可用逗號或換行隔開多個。
+    """
+    rules = {}
+    if not rows: return rules
+    header = [str(h).strip() for h in rows[0]]
+    missing = [col for col in COLOR_RULE_COLS if col not in header]
+    if missing: raise ValueError(f"規則表缺少欄位：{'、'.join(missing)}")
+    cols = [header.index(col) for col in COLOR_RULE_COLS]
+    model = interval = ""
+    for row in rows[1:]:
+        row = [str(row[i]).strip() if i < len(row) else "" for i in cols]
+        model, interval = row[0] or model, clean_interval(row[1]) or interval
+        color = COLOR_NAMES.get(row[2].lower())
+        if not (model and interval and color): continue
+        level = rules.setdefault(model, {}).setdefault(interval, {"red": [], "green": []})
+        level[color].extend(key.strip() for key in re.split(r"[,，\n]", row[3]) if key.strip())
+    return rules
+
+def load_color_rules_file(path):
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        # 保養類型與 CSV、規則表一樣經過 clean_interval，"500k"、"1M保養" 才對得上
+        rules = {}
+        for model, levels in data.items():
+            for interval, colors in levels.items():
+                level = rules.setdefault(str(model).strip(), {}).setdefault(clean_interval(interval), {"red": [], "green": []})
+                for color in level: level[color].extend(colors.get(color, []))
+        return rules
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return parse_color_rule_rows(list(csv.reader(f)))
+
+def _compile_keys(keys):
+    # 長的料號排前面；沒有料號時回傳 None，不做比對
+    keys = sorted({k for k in keys if k}, key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, keys))) if keys else None
+
+class PartColorRules:
+    """料件名稱 → (CSS class, 圖示)；紅色清單優先於綠色，與逐一 `key in part_name` 的結果相同"""
+    NORMAL = ("text-normal", "🔩")
+
+    def __init__(self, rules):
+        self.rules = rules
+        # 規則內容的雜湊，用來當依規則上色的快取鍵
+        self.version = hashlib.sha1(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+        self._lock = threading.Lock()
+        self._compiled = {}
+
+    def matcher(self, model, interval):
+        key = (model, clean_interval(interval))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            level = self.rules.get(key[0], {}).get(key[1], {})
+            compiled = (_compile_keys(level.get("red", [])), _compile_keys(level.get("green", [])))
+            with self._lock: self._compiled[key] = compiled
+        return compiled
+
+    def classify(self, part_name, model, interval):
+        red, green = self.matcher(model, interval)
+        if red is not None and red.search(part_name): return "text-red", "🔴"
+        if green is not None and green.search(part_name): return "text-green", "🟢"
+        return self.NORMAL
+
+# === 增量式搜尋索引 (雜湊字元 n-gram + 自行維護文件頻率，單筆異動只重算那一筆) ===
+SEARCH_N_FEATURES = 2 ** 20
+SEARCH_INDEX_DIR = os.path.join(SNAPSHOT_DIR, "search_index")
+SEARCH_INDEX_FORMAT = 2  # 索引檔結構或向量化參數改變時遞增
+SEARCH_INDEX_KEEP = 2  # 磁碟上保留最新的幾份索引
+# 欄位權重在計分時才套用 (每個欄位各自一份詞頻)，調整權重不必重新分析文字
+SEARCH_FIELD_WEIGHTS = {'設備型號': 2.0, '主題(事件簡述)': 5.0, '原因(異常查找、分析)': 3.0, '處置、應對': 1.0}
+SEARCH_FIELDS = list(SEARCH_FIELD_WEIGHTS)
+
+def corpus_hash(ids, fields):
+    h = hashlib.sha1(f"{SEARCH_INDEX_FORMAT}:{SEARCH_N_FEATURES}:{'|'.join(SEARCH_FIELDS)}".encode("utf-8"))
+    for rid, *texts in zip(ids, *(fields[col] for col in SEARCH_FIELDS)):
+        h.update(("\x1f".join([rid] + texts) + "\x1e").encode("utf-8"))
+    return h.hexdigest()
+
+def _grams_analyzer(grams):
+    return grams
+
+def _field_sum(n_docs, weights):
+    """n_docs x (n_docs * 欄位數) 的加總矩陣：左乘堆疊矩陣即得每筆文件各欄位加權相加後的詞頻"""
+    n_fields = len(weights)
+    return sp.csr_matrix((np.tile(weights, n_docs), np.arange(n_docs * n_fields), np.arange(0, n_docs * n_fields + 1, n_fields)), shape=(n_docs, n_docs * n_fields))
+
+def _concat_rows(parts, n_rows):
+    """parts：每筆文件的 (各列長度, 特徵索引, 值)，依序接成一個 CSR (只是陣列串接，不重新分析文字)"""
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    if parts: np.cumsum(np.concatenate([p[0] for p in parts]), out=indptr[1:])
+    indices = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.int32)
+    data = np.concatenate([p[2] for p in parts]) if parts else np.zeros(0)
+    return sp.csr_matrix((data, indices, indptr), shape=(n_rows, SEARCH_N_FEATURES))
+
+def _row_block(matrix, start, end):
+    # CSR 第 start~end 列的 (各列長度, 特徵索引, 值)，都是原陣列的切片
+    indptr = matrix.indptr
+    return np.diff(indptr[start:end + 1]), matrix.indices[indptr[start]:indptr[end]], matrix.data[indptr[start]:indptr[end]]
+
+def _splice_rows(matrix, rows_per_doc, changes):
+    """changes：{文件位置: (各列長度, 特徵索引, 值)}；其餘文件沿用 matrix 原本的列，整段切片拼接，不必逐筆串"""
+    parts, done = [], 0
+    for pos in sorted(changes) + [matrix.shape[0] // rows_per_doc]:
+        parts.append(_row_block(matrix, done * rows_per_doc, pos * rows_per_doc))
+        if pos in changes: parts.append(changes[pos])
+        done = pos + 1
+    return _concat_rows(parts, matrix.shape[0])
+
+def _idf(n_docs, doc_freq):
+    # 與 TfidfVectorizer(smooth_idf=True) 相同的 idf
+    return np.log((1 + n_docs) / (1 + doc_freq)) + 1.0
+
+class SearchView:
+    """某一版資料的唯讀索引：每筆文件依 SEARCH_FIELDS 順序佔連續幾列 (第 i 筆第 f 欄在第 i*欄位數+f 列)，計分時才套用 TF-IDF 與欄位權重
+
+    idf、combined_sq 可由增量索引直接給 (只改了有變動的部分)，沒給時從詞頻整份算出。
+    """
+    def __init__(self, ids, fields, stacked, doc_freq, vectorizer, weights=None, idf=None, combined_sq=None):
+        self.ids = ids
+        self.fields = fields  # 欄位 -> 字串清單，順序同 ids (模糊比對也直接用)
+        self.stacked = stacked
+        self.vectorizer = vectorizer
+        # 與 TfidfVectorizer(smooth_idf=True) 相同的 idf 與 l2 正規化
+        self.idf = _idf(len(ids), doc_freq) if idf is None else idf
+        self.known = doc_freq > 0  # 查詢中語料沒出現過的 n-gram 與 TfidfVectorizer 一樣忽略
+        self._idf_sq = self.idf ** 2
+        # 關鍵字倒排表第一次用到才建；同一份 view 所有 session 共用，建立時上鎖、建好後一次指定
+        self._postings = None
+        self._postings_lock = threading.Lock()
+        # 與 char_wb 使用相同的雜湊，關鍵字的 n-gram 才能對到同一個特徵欄
+        self._gram_hasher = HashingVectorizer(analyzer=_grams_analyzer, n_features=stacked.shape[1], alternate_sign=False, norm=None)
+        self._apply_weights(weights or SEARCH_FIELD_WEIGHTS, combined_sq)
+
+    def _apply_weights(self, weights, combined_sq=None):
+        self.weight_map = dict(weights)
+        self.weights = np.array([float(weights.get(col, 0.0)) for col in SEARCH_FIELDS])
+        if combined_sq is None:
+            # 文件向量 = 各欄位詞頻加權相加；保留逐項平方，文件長度只要再乘一次 idf 平方
+            combined_sq = _field_sum(len(self.ids), self.weights) @ self.stacked
+            combined_sq.data **= 2
+        self.combined_sq = combined_sq
+        self.doc_norms = np.sqrt(combined_sq @ self._idf_sq)
+        self.doc_norms[self.doc_norms == 0] = 1.0
+
+    def with_weights(self, weights):
+        """同一份詞頻換一組欄位權重 (只重算文件長度)"""
+        view = copy.copy(self)
+        view._apply_weights(weights)
+        return view
+
+    def scores(self, text):
+        q = self.vectorizer.transform([text])
+        q.data[~self.known[q.indices]] = 0
+        q_norm = np.sqrt((q.multiply(q) @ self._idf_sq).sum())
+        if q_norm == 0: return np.zeros(len(self.doc_norms))
+        # 查詢向量展開成稠密陣列，矩陣乘向量只走一遍非零元素，比稀疏乘稀疏快
+        weighted = np.zeros(self.stacked.shape[1])
+        weighted[q.indices] = q.data * self._idf_sq[q.indices]
+        per_field = (self.stacked @ weighted).reshape(-1, len(SEARCH_FIELDS))
+        return per_field @ self.weights / (self.doc_norms * q_norm)
+
+    def _keyword_postings(self):
+        # (CSC 倒排表, 各欄位小寫內容)：堆疊矩陣轉成 CSC，每一欄就是該 n-gram 的倒排串列
+        if self._postings is None:
+            with self._postings_lock:
+                if self._postings is None:
+                    columns = [self.fields[col] for col in SEARCH_FIELDS]
+                    contents = [text.lower() for doc in zip(*columns) for text in doc]
+                    self._postings = (self.stacked.tocsc(), contents)
+        return self._postings
+
+    def keyword_rows(self, keyword):
+        """包含 keyword (不分大小寫) 的文件列號：n-gram 倒排表交集取候選，再逐筆確認排除雜湊碰撞
+
+        關鍵字不含空白，一定整段落在同一個欄位裡，所以直接在欄位層級 (堆疊矩陣的列) 取交集。
+        """
+        n_fields = len(SEARCH_FIELDS)
+        postings, contents = self._keyword_postings()
+        k = keyword.lower()
+        n = min(3, len(k))
+        grams = sorted({k[i:i + n] for i in range(len(k) - n + 1)})
+        cols = self._gram_hasher.transform([grams]).indices
+        lists = sorted((postings.indices[postings.indptr[c]:postings.indptr[c + 1]] for c in cols), key=len)
+        if not lists: return np.zeros(0, dtype=np.int64)
+        rows = lists[0]
+        for posting in lists[1:]:
+            if len(rows) == 0: break
+            rows = np.intersect1d(rows, posting, assume_unique=True)
+        hits = np.array([i for i in rows if k in contents[i]], dtype=np.int64)
+        return np.unique(hits // n_fields)
+
+class IncrementalSearchIndex:
+    """以紀錄ID為單位維護每筆文件各欄位的詞頻與全域文件頻率；新增、修改、刪除只分析有變動的那幾筆
+
+    每筆文件的詞頻列與加權平方列都各自保存，同步時只重算有變動的文件；筆數不變時 idf 也只改文件頻率有變的特徵。
+    只改內容時沿用上一版矩陣，整段切片拼接換掉有變動的列；筆數或順序改變才逐筆把陣列串回整份矩陣。
+    仍與總筆數成正比的部分：逐筆比對內容找出變動、矩陣陣列的複製、文件長度的一次稀疏矩陣乘向量、
+    背景重寫索引檔，以及新一版第一次查關鍵字時重建倒排表。
+    """
+    def __init__(self, index_dir=SEARCH_INDEX_DIR, weights=None):
+        self.index_dir = index_dir
+        self.weights = dict(weights or SEARCH_FIELD_WEIGHTS)
+        self._lock = threading.Lock()
+        self.vectorizer = HashingVectorizer(analyzer='char_wb', ngram_range=(1, 3), n_features=SEARCH_N_FEATURES, alternate_sign=False, norm=None)
+        self._docs = {}  # 紀錄ID -> (各欄位內容, 任一欄位出現的特徵索引, (各欄位列長度, 特徵索引, 次數), 加權詞頻平方的 (列長度, 特徵索引, 值))
+        self._doc_freq = np.zeros(SEARCH_N_FEATURES, dtype=np.float64)
+        self._view = None
+        self._saving = False
+        self._save_thread = None
+
+    def set_weights(self, weights):
+        """換欄位權重：目前的索引直接重算文件長度，不重新分析文字"""
+        with self._lock:
+            if dict(weights) == self.weights: return
+            self.weights = dict(weights)
+            if self._view is None: return
+            self._view = self._view.with_weights(self.weights)
+            # 各筆的加權平方列跟著換成新權重的
+            for rid, sq in zip(self._view.ids, self._split_rows(self._view.combined_sq, 1)):
+                self._docs[rid] = self._docs[rid][:3] + (sq,)
+
+    @staticmethod
+    def _split_rows(matrix, rows_per_doc):
+        # 把 CSR 依每筆文件的列數切回各筆的 (各列長度, 特徵索引, 值)
+        lengths, bounds = np.diff(matrix.indptr), matrix.indptr.tolist()
+        for start in range(0, matrix.shape[0], rows_per_doc):
+            end = start + rows_per_doc
+            yield lengths[start:end], matrix.indices[bounds[start]:bounds[end]], matrix.data[bounds[start]:bounds[end]]
+
+    def _store_docs(self, doc_ids, doc_texts, stacked):
+        """stacked：這幾筆文件的堆疊矩陣 (每筆連續 SEARCH_FIELDS 列)；回傳 (文件頻率有變動的特徵, 這幾筆的加權平方矩陣)"""
+        n_fields = len(SEARCH_FIELDS)
+        union = _field_sum(len(doc_ids), np.ones(n_fields)) @ stacked  # 任一欄位出現過的特徵
+        combined = _field_sum(len(doc_ids), np.array([self.weights.get(col, 0.0) for col in SEARCH_FIELDS])) @ stacked
+        squares = combined.copy()
+        squares.data **= 2
+        rows = zip(self._split_rows(stacked, n_fields), self._split_rows(squares, 1))
+        for i, (rid, texts, (row, sq)) in enumerate(zip(doc_ids, doc_texts, rows)):
+            self._docs[rid] = (texts, union.indices[union.indptr[i]:union.indptr[i + 1]], row, sq)
+        self._doc_freq += np.bincount(union.indices, minlength=SEARCH_N_FEATURES)
+        return union.indices, squares
+
+    def _load(self, key, ids, texts, fields):
+        # 冷啟動時若磁碟上有同一份語料的索引，直接讀檔，不必重新分析文字
+        path = os.path.join(self.index_dir, key)
+        try:
+            with open(path + ".json", encoding="utf-8") as f: meta = json.load(f)
+            if meta.get("format") != SEARCH_INDEX_FORMAT or meta.get("n_docs") != len(ids) or meta.get("fields") != SEARCH_FIELDS: return None
+            stacked = sp.load_npz(path + ".npz").tocsr()
+        except Exception:
+            return None
+        combined_sq = self._store_docs(ids, texts, stacked)[1]
+        self._view = SearchView(ids, fields, stacked, self._doc_freq, self.vectorizer, self.weights, combined_sq=combined_sq)
+        return self._view
+
+    def _save(self, key, view):
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            path = os.path.join(self.index_dir, key)
+            sp.save_npz(path + ".tmp.npz", view.stacked, compressed=False)
+            os.replace(path + ".tmp.npz", path + ".npz")
+            with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+                json.dump({"format": SEARCH_INDEX_FORMAT, "n_docs": len(view.ids), "n_features": SEARCH_N_FEATURES, "fields": SEARCH_FIELDS}, f, ensure_ascii=False)
+            os.replace(path + ".json.tmp", path + ".json")
+            old_files = sorted(glob.glob(os.path.join(self.index_dir, "*.npz")), key=os.path.getmtime, reverse=True)[SEARCH_INDEX_KEEP:]
+            for old in old_files:
+                for ext in (".npz", ".json"):
+                    try: os.remove(old[:-len(".npz")] + ext)
+                    except OSError: pass
+        except Exception:
+            pass
+        finally:
+            with self._lock: self._saving = False
+
+    def _save_async(self, view):
+        # 背景寫檔；已有一份在寫就略過，下次異動會再存最新版
+        if self._saving: return
+        self._saving = True
+        def run():
+            self._save(corpus_hash(view.ids, view.fields), view)
+        self._save_thread = threading.Thread(target=run, daemon=True)
+        self._save_thread.start()
+
+    def persist(self):
+        """確定目前的索引已寫到磁碟 (批次工具讓子行程直接讀檔用)，回傳語料雜湊"""
+        view = self._view
+        if view is None: return None
+        if self._save_thread is not None: self._save_thread.join()
+        key = corpus_hash(view.ids, view.fields)
+        if not os.path.exists(os.path.join(self.index_dir, key + ".json")):
+            with self._lock: self._saving = True
+            self._save(key, view)
+        return key
+
+    def _remove(self, rid):
+        indices = self._docs.pop(rid)[1]
+        self._doc_freq[indices] -= 1
+        return indices
+
+    def sync(self, ids, fields):
+        """fields：SEARCH_FIELDS 每個欄位的字串清單，順序同 ids"""
+        with self._lock:
+            ids = list(ids)
+            fields = {col: list(fields[col]) for col in fields}
+            texts = list(zip(*(fields[col] for col in SEARCH_FIELDS)))
+            if self._view is None and not self._docs:
+                with metrics.timer("index.load") as t:
+                    loaded = self._load(corpus_hash(ids, fields), ids, texts, fields)
+                    t.count = len(ids) if loaded is not None else 0
+                if loaded is not None: return loaded
+            changed = [(pos, rid, doc) for pos, (rid, doc) in enumerate(zip(ids, texts)) if self._docs.get(rid, (None,))[0] != doc]
+            removed = self._docs.keys() - set(ids)
+            if not changed and not removed and self._view is not None and self._view.ids == ids:
+                return self._view
+            with metrics.timer("index.build") as t:
+                t.count = len(changed) + len(removed)  # 實際重新分析/移除的筆數
+                touched = [self._remove(rid) for rid in removed]
+                touched += [self._remove(rid) for _, rid, _ in changed if rid in self._docs]
+                if changed:
+                    # 每個欄位各分析一次原文，不再把欄位重複串接成長字串
+                    touched.append(self._store_docs([rid for _, rid, _ in changed], [doc for _, _, doc in changed], self.vectorizer.transform([text for _, _, doc in changed for text in doc]).tocsr())[0])
+                idf = None
+                prev = self._view
+                if prev is not None and len(prev.ids) == len(ids) and touched:
+                    # 筆數不變時，只有文件頻率變動的特徵 idf 會變，其餘沿用上一版
+                    touched = np.unique(np.concatenate(touched))
+                    idf = prev.idf.copy()
+                    idf[touched] = _idf(len(ids), self._doc_freq[touched])
+                if prev is not None and prev.ids == ids:
+                    # 只改了內容 (順序、筆數不變)：沿用上一版矩陣，只換掉有變動那幾筆的列
+                    stacked = _splice_rows(prev.stacked, len(SEARCH_FIELDS), {pos: self._docs[rid][2] for pos, rid, _ in changed})
+                    combined_sq = _splice_rows(prev.combined_sq, 1, {pos: self._docs[rid][3] for pos, rid, _ in changed})
+                else:
+                    # 依目前 DataFrame 順序把每筆文件的列拼回 CSR (只是陣列串接，不重新分析文字)
+                    docs = [self._docs[rid] for rid in ids]
+                    stacked = _concat_rows([doc[2] for doc in docs], len(docs) * len(SEARCH_FIELDS))
+                    combined_sq = _concat_rows([doc[3] for doc in docs], len(docs))
+                self._view = SearchView(ids, fields, stacked, self._doc_freq, self.vectorizer, self.weights, idf, combined_sq)
+            self._save_async(self._view)
+            return self._view
+
+def sync_search_index(index, df):
+    """把維修紀錄 DataFrame 同步進索引，回傳可查詢的 SearchView"""
+    fields = {col: df[col].astype(str).tolist() for col in SEARCH_FIELDS}
+    return index.sync(df['original_id'].tolist(), fields)
+
+
+# === 模糊比對 (rapidfuzz 批次 API，C++ 多執行緒計分) ===
+FUZZY_FIELDS = ['主題(事件簡述)', '原因(異常查找、分析)']
+FUZZY_WORKERS = -1  # -1 表示使用全部 CPU 核心
+
+def fuzzy_scores(query, choices):
+    if len(choices) == 0: return np.zeros(0)
+    return process.cdist([query], choices, scorer=fuzz.token_set_ratio, dtype=np.float32, workers=FUZZY_WORKERS)[0] / 100.0
+
+SEARCH_TOP_K = 10
+SEARCH_MIN_SCORE = 0.15
+SEARCH_CANDIDATES = 300  # 兩階段檢索：TF-IDF 先取前 N 筆候選，模糊比對與關鍵字加分只算候選；0 表示全部比對
+
+def top_k_rows(scores, k, min_score):
+    # 只對過門檻的列做部分選取 (argpartition)，再把 k 筆排序，不必整個排序
+    hits = np.flatnonzero(scores > min_score)
+    if len(hits) > k:
+        hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+    return hits[np.argsort(-scores[hits], kind="stable")]
+
+def rank_records(query, df, engine, candidates=SEARCH_CANDIDATES, top_k=SEARCH_TOP_K):
+    """回傳相似度最高的 top_k 筆紀錄 (含 final_score 欄)，依分數由高到低"""
+    if not query or df.empty: return pd.DataFrame()
+    with metrics.timer("search.score") as t:
+        results = _rank_records(query, df, engine, candidates, top_k)
+        t.count = len(df)
+    return results
+
+def _rank_records(query, df, engine, candidates, top_k):
+    smart_query = expand_query(query)
+    # 所有分數累加在同一個 NumPy 陣列
+    scores = np.zeros(len(df))
+    use_index = HAS_AI and engine
+    if use_index:
+        try:
+            scores += engine.scores(smart_query) * 0.6
+        except: pass
+    keywords = [k for k in query.split() if len(k) > 1]
+    # 第一階段：稀疏矩陣內積算出的 TF-IDF 分數取前 N 名作為候選
+    rows = None
+    if use_index and 0 < candidates < len(df):
+        rows = np.sort(np.argpartition(-scores, candidates - 1)[:candidates])
+    # 第二階段：較貴的模糊比對只跑候選
+    if HAS_FUZZY:
+        # 優先用索引裡已備好的字串清單，免得每次查詢都從 DataFrame 轉一次
+        fields = engine.fields if engine and engine.fields else {col: df[col].tolist() for col in FUZZY_FIELDS}
+        topics, causes = fields['主題(事件簡述)'], fields['原因(異常查找、分析)']
+        if rows is not None:
+            topics, causes = [topics[i] for i in rows], [causes[i] for i in rows]
+        fuzzy = fuzzy_scores(query, topics) * 0.3 + fuzzy_scores(query, causes) * 0.1
+        if rows is None: scores += fuzzy
+        else: scores[rows] += fuzzy
+    if use_index:
+        in_candidates = None
+        if rows is not None:
+            in_candidates = np.zeros(len(df), dtype=bool)
+            in_candidates[rows] = True
+        for k in keywords:
+            hits = engine.keyword_rows(k)
+            if in_candidates is not None: hits = hits[in_candidates[hits]]
+            scores[hits] += 0.2
+    else:
+        for k in keywords:
+            # 關鍵字不含空白，只會整段出現在某一個欄位裡
+            hit = np.zeros(len(df), dtype=bool)
+            for col in SEARCH_FIELDS:
+                hit |= df[col].astype(str).str.contains(k, case=False, regex=False).to_numpy()
+            scores += hit * 0.2
+    # 只取出入選的幾列，不複製整張表
+    top_rows = top_k_rows(scores, top_k, SEARCH_MIN_SCORE)
+    results = df.iloc[top_rows].copy()
+    results['final_score'] = scores[top_rows]
+    return results
+
+def pick_best_row(results):
+    # 診斷建議取第一筆有寫明原因的案例，都沒有才用最高分那筆
+    for _, row in results.iterrows():
+        cause_text = str(row['原因(異常查找、分析)']).strip()
+        if len(cause_text) > 2 and cause_text not in ["無", "待處理", "未知", "nan"]:
+            return row
+    return results.iloc[0]
+
+def super_smart_search(query, df, engine, candidates=SEARCH_CANDIDATES):
+    if not query or df.empty: return pd.DataFrame(), "", ""
+    results = rank_records(query, df, engine, candidates)
+    summary_md = ""
+    external_link = ""
+    if not results.empty:
+        best_row = pick_best_row(results)
+        clean_cause = clean_text(best_row['原因(異常查找、分析)'])
+        clean_topic = clean_text(best_row['主題(事件簡述)'])
+        summary_md = f"""
+        <div style="background-color: var(--secondary-background-color); padding: 15px; border-radius: 10px; border-left: 5px solid #3182CE;">
+            <h4 style="margin-top:0;">🤖 AI 診斷報告</h4>
+            <p>分析您的描述，資料庫中最相似的案例為 <b>「{clean_topic}」</b>。</p>
+            <p>👉 <b>建議檢查方向：</b><br>
+            <span style="color: var(--text-color); font-size: 1.1em; opacity: 0.9;">{clean_cause if len(clean_cause) > 1 else "暫無明確內部紀錄，建議參考下方外部搜尋。"}</span>
+            </p>
+        </div>
+        """
+        search_term = f"{best_row['設備型號']} {clean_topic} 故障排除"
+        external_link = f"https://www.google.com/search?q={search_term}"
+    else:
+        summary_md = """
+        <div style="background-color: var(--secondary-background-color); padding: 15px; border-radius: 10px; border-left: 5px solid #718096;">
+            🤖 目前資料庫中找不到相似度夠高的案例。
+        </div>
+        """
+        external_link = f"https://www.google.com/search?q=設備維修 {query}"
+    return results, summary_md, external_link
+
+def normalize_query(query):
+    return " ".join(query.split())
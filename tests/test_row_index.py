@@ -0,0 +1,49 @@
+from repair_core import RecordRowIndex
+
+
+def op(kind, rid):
+    return {"kind": kind, "id": rid}
+
+
+def test_unbuilt_index_plans_no_rows():
+    index = RecordRowIndex()
+    assert not index.built
+    assert index.plan([op("append", "n1"), op("update", "a")]) == [None, None]
+    assert not index.matches([])
+
+
+def test_plan_accounts_for_earlier_deletes_and_appends():
+    index = RecordRowIndex()
+    index.rebuild(["a", "b", "c", "d"])
+    ops = [op("delete", "b"), op("update", "d"), op("append", "n1"), op("update", "n1"), op("delete", "a"), op("update", "c")]
+    assert index.plan(ops) == [3, 4, 5, 5, 2, 2]
+    assert index.plan([op("update", "missing")]) == [None]
+
+
+def test_commit_moves_rows_and_matches_sheet():
+    index = RecordRowIndex()
+    index.rebuild(["a", "b", "c"])
+    index.commit([op("delete", "a"), op("append", "n1")])
+    assert index.row("b") == 2 and index.row("c") == 3 and index.row("n1") == 4
+    assert index.matches(["b", "c", "n1"])
+    assert not index.matches(["c", "b", "n1"])
+    assert not index.matches(["b", "c"])
+
+
+def test_late_rebuild_from_older_fetch_is_rejected():
+    index = RecordRowIndex()
+    started = index.version
+    index.rebuild(["a", "b"])
+    index.commit([op("append", "n1")])
+    assert not index.rebuild(["a", "b"], started)
+    assert index.row("n1") == 4
+
+
+def test_rebuild_from_sheet_replaces_stale_rows():
+    # 別人在試算表最上面插入一列：重讀ID欄後，更新要落在新的列號
+    index = RecordRowIndex()
+    index.rebuild(["a", "b"])
+    sheet_ids = ["x", "a", "b"]
+    assert not index.matches(sheet_ids)
+    assert index.rebuild(sheet_ids)
+    assert index.plan([op("update", "b"), op("append", "n1")]) == [4, 5]
@@ -0,0 +1,80 @@
+import tempfile
+
+import numpy as np
+import pytest
+
+from repair_core import HAS_AI, SEARCH_FIELDS, SEARCH_FIELD_WEIGHTS, IncrementalSearchIndex
+
+pytestmark = pytest.mark.skipif(not HAS_AI, reason="需要 scikit-learn")
+
+WORDS = ["馬達", "異音", "皮帶", "斷裂", "感應器", "過熱", "軸承", "氣壓", "漏油", "卡料", "X-12"]
+QUERIES = ["馬達 異音", "皮帶斷裂", "X-12 漏油", "完全沒出現過"]
+
+
+def make_doc(rng):
+    return tuple(" ".join(rng.choice(WORDS, rng.integers(1, 5))) for _ in SEARCH_FIELDS)
+
+
+def fields_of(docs):
+    return {col: [doc[f] for doc in docs] for f, col in enumerate(SEARCH_FIELDS)}
+
+
+def assert_same_as_fresh(view, ids, docs, tmp_path, weights=None):
+    fresh = IncrementalSearchIndex(tempfile.mkdtemp(dir=tmp_path), weights).sync(ids, fields_of(docs))
+    assert view.ids == ids
+    assert (view.stacked != fresh.stacked).nnz == 0
+    np.testing.assert_allclose(view.idf, fresh.idf)
+    np.testing.assert_allclose(view.doc_norms, fresh.doc_norms)
+    for query in QUERIES:
+        np.testing.assert_allclose(view.scores(query), fresh.scores(query))
+
+
+def test_incremental_sync_matches_fresh_build(tmp_path):
+    rng = np.random.default_rng(0)
+    ids = [f"r{i}" for i in range(200)]
+    docs = [make_doc(rng) for _ in ids]
+    index = IncrementalSearchIndex(str(tmp_path / "index"))
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+
+    # 只改內容 (走切片拼接與局部 idf)
+    docs[10], docs[150] = make_doc(rng), ("全新 內容",) * len(SEARCH_FIELDS)
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+    # 刪除
+    del ids[3], docs[3]
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+    # 新增
+    ids.append("new")
+    docs.append(make_doc(rng))
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+    # 換順序
+    ids.reverse()
+    docs.reverse()
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+    # 同一個位置換成另一筆紀錄 (筆數不變、ID 不同)
+    ids[0], docs[0] = "replaced", make_doc(rng)
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+
+
+def test_sync_after_weight_change_matches_fresh_build(tmp_path):
+    rng = np.random.default_rng(1)
+    ids = [f"r{i}" for i in range(50)]
+    docs = [make_doc(rng) for _ in ids]
+    weights = {**SEARCH_FIELD_WEIGHTS, SEARCH_FIELDS[-1]: 4.0}
+    index = IncrementalSearchIndex(str(tmp_path / "index"))
+    index.sync(ids, fields_of(docs))
+    index.set_weights(weights)
+    docs[5] = make_doc(rng)
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path, weights)
+
+
+def test_edit_after_loading_from_disk_matches_fresh_build(tmp_path):
+    rng = np.random.default_rng(2)
+    ids = [f"r{i}" for i in range(50)]
+    docs = [make_doc(rng) for _ in ids]
+    first = IncrementalSearchIndex(str(tmp_path / "index"))
+    first.sync(ids, fields_of(docs))
+    first.persist()
+    index = IncrementalSearchIndex(str(tmp_path / "index"))
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
+    docs[7] = make_doc(rng)
+    assert_same_as_fresh(index.sync(ids, fields_of(docs)), ids, docs, tmp_path)
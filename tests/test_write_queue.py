@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("gspread")
+from app import RepairWriteQueue
+
+
+def queue_with(*ops, inflight=0):
+    queue = RepairWriteQueue(store=None, pool=None)
+    queue._ops = [dict(op) for op in ops]
+    queue._inflight = inflight
+    return queue
+
+
+def append(rid, **record):
+    return {"kind": "append", "id": rid, "record": record}
+
+
+def update(rid, **record):
+    return {"kind": "update", "id": rid, "record": record, "cols": set(record)}
+
+
+def delete(rid):
+    return {"kind": "delete", "id": rid}
+
+
+def test_update_merges_into_queued_update():
+    queue = queue_with(update("a", 主題="x"))
+    assert queue._coalesce(update("a", 原因="y"))
+    assert queue._ops == [{"kind": "update", "id": "a", "record": {"主題": "x", "原因": "y"}, "cols": {"主題", "原因"}}]
+
+
+def test_update_folds_into_queued_append():
+    queue = queue_with(append("n1", 主題="x", 原因=""))
+    assert queue._coalesce(update("n1", 原因="y"))
+    assert queue._ops == [append("n1", 主題="x", 原因="y")]
+
+
+def test_delete_cancels_queued_append_and_its_updates():
+    queue = queue_with(update("a", 主題="x"), append("n1", 主題="x"), update("n1", 原因="y"))
+    assert queue._coalesce(delete("n1"))
+    assert queue._ops == [update("a", 主題="x")]
+
+
+def test_delete_drops_queued_updates_but_is_still_sent():
+    queue = queue_with(update("a", 主題="x"), update("b", 主題="z"))
+    assert not queue._coalesce(delete("a"))
+    assert queue._ops == [update("b", 主題="z")]
+
+
+def test_inflight_ops_are_never_merged():
+    # 已在送出中的那一批不可再改；新的修改要另外排隊
+    queue = queue_with(update("a", 主題="x"), inflight=1)
+    assert not queue._coalesce(update("a", 原因="y"))
+    assert not queue._coalesce(delete("a"))
+    assert queue._ops == [update("a", 主題="x")]